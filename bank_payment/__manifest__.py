@@ -23,10 +23,14 @@
     # always loaded
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
         'wizard/bank_payment_view.xml',
         'views/account_move_views.xml',
         'views/view_account_position_form.xml',
         'views/view_partner_bank.xml',
         'views/account_payment_term.xml',
+        'views/bank_payment_job_views.xml',
+        'views/bank_payment_log_views.xml',
+        'views/bank_payment_batch_views.xml',
     ],
 }
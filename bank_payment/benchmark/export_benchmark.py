@@ -0,0 +1,289 @@
+"""
+Benchmark of bank payment export.
+
+Creates synthetic posted vendor bills, runs the export on them and reports
+wall time, SQL query count and peak Python memory of
+`_write_bank_payment_files` (the path every export takes),
+`action_download_bank_payment` (with streaming disabled, so the file is
+generated by the action) and of the streamed download generator.
+Every measurement starts with empty row cache of the bills and is rolled back
+afterwards (so batches of one measurement do not affect the next one).
+Peak memory is measured in a separate run, tracing of allocations would slow
+down the timed run.
+Everything runs in one transaction that is rolled back at the end.
+
+Usage (database must have bank_payment installed):
+
+    python export_benchmark.py -c /etc/odoo.conf -d DB --sizes 1000,10000,100000 \\
+        --mix domestic=60,international=30,payment_card=10
+
+Results are compared with baseline.json (next to this script) and the
+script exits with status 1 when any metric is worse than baseline by more
+than --tolerance. Use --update-baseline to store current results.
+This module is not imported by the addon.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+from odoo import api, fields, Command, SUPERUSER_ID
+from odoo.modules.registry import Registry
+from odoo.tools import config
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+METRICS = ('time', 'queries', 'memory')
+TRANS_TYPES = ('domestic', 'international', 'payment_card')
+BATCH_SIZE = 1000
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-c', '--config', help="Odoo configuration file")
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--sizes', default='1000,10000,100000', help="Comma separated numbers of bills")
+    parser.add_argument('--mix', default='domestic=60,international=30,payment_card=10',
+                        help="Share of bills per bank transfer type (fiscal position)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="Allowed regression against baseline (0.2 = 20%%)")
+    parser.add_argument('--update-baseline', action='store_true')
+    args = parser.parse_args(argv)
+
+    args.sizes = [int(size) for size in args.sizes.split(',')]
+    mix = dict(part.split('=') for part in args.mix.split(','))
+    unknown = set(mix) - set(TRANS_TYPES)
+    if unknown:
+        parser.error(f"Unknown transfer type(s) in --mix: {', '.join(sorted(unknown))}")
+    args.mix = {trans_type: float(share) for trans_type, share in mix.items()}
+    return args
+
+
+####################################################
+# DATA
+####################################################
+
+def prepare_master_data(env, partner_count: int) -> dict:
+    """
+    return records shared by all synthetic bills
+    """
+    company = env.company
+    if not company.partner_id.bank_ids:
+        env['res.partner.bank'].create({'partner_id': company.partner_id.id, 'acc_number': '123456789012345'})
+
+    bank = env['res.bank'].create({'name': 'Benchmark Bank', 'bic': 'BENCHDKKXXX'})
+    country = env.ref('base.dk')
+    fiscal_positions = {
+        trans_type: env['account.fiscal.position'].create({
+            'name': f'Benchmark {trans_type}',
+            'bank_trans_type': trans_type,
+        })
+        for trans_type in TRANS_TYPES
+    }
+    partners = env['res.partner'].create([{
+        'name': f'Benchmark Supplier {i}',
+        'street': f'Benchmark Street {i}',
+        'zip': '2100',
+        'city': 'Copenhagen',
+        'country_id': country.id,
+    } for i in range(partner_count)])
+    partner_banks = env['res.partner.bank'].create([{
+        'partner_id': partner.id,
+        'acc_number': f'{partner.id:014d}',
+        'bank_id': bank.id,
+        'from_type': '2',
+        'card_code': '71',
+    } for partner in partners])
+    journal = env['account.journal'].search([
+        ('type', '=', 'purchase'),
+        ('company_id', '=', company.id),
+    ], limit=1)
+
+    return {
+        'fiscal_positions': fiscal_positions,
+        'partner_banks': partner_banks,
+        'journal': journal,
+    }
+
+
+def create_bills(env, count: int, mix: dict, rnd: random.Random):
+    """
+    return posted vendor bills with given mix of bank transfer types
+    """
+    master = prepare_master_data(env, max(1, count // 10))
+    trans_types = rnd.choices(list(mix), weights=list(mix.values()), k=count)
+    today = fields.Date.today()
+    bills = env['account.move']
+    for start in range(0, count, BATCH_SIZE):
+        vals_list = []
+        for i in range(start, min(start + BATCH_SIZE, count)):
+            partner_bank = rnd.choice(master['partner_banks'])
+            vals_list.append({
+                'move_type': 'in_invoice',
+                'journal_id': master['journal'].id,
+                'partner_id': partner_bank.partner_id.id,
+                'partner_bank_id': partner_bank.id,
+                'fiscal_position_id': master['fiscal_positions'][trans_types[i]].id,
+                'invoice_date': today,
+                'invoice_date_due': today + timedelta(days=rnd.randint(0, 30)),
+                'payment_reference': f'BENCH{i}',
+                'ref': f'BENCH-REF-{i}',
+                'narration': f'<p>Benchmark bill {i}</p>',
+                'invoice_line_ids': [Command.create({
+                    'name': 'Benchmark',
+                    'quantity': 1,
+                    'price_unit': rnd.randint(100, 10_000_000) / 100,
+                    'tax_ids': [Command.clear()],
+                })],
+            })
+        batch = env['account.move'].create(vals_list)
+        batch.action_post()
+        bills |= batch
+        env.invalidate_all()
+
+    return bills
+
+
+####################################################
+# MEASURE
+####################################################
+
+def measure(env, function) -> dict:
+    """
+    return wall time (s) and SQL query count of function()
+    """
+    env.flush_all()
+    env.invalidate_all()
+    queries = env.cr.sql_log_count
+    start = time.perf_counter()
+    function()
+    env.flush_all()
+    elapsed = time.perf_counter() - start
+    return {
+        'time': round(elapsed, 3),
+        'queries': env.cr.sql_log_count - queries,
+    }
+
+
+def measure_memory(env, function) -> dict:
+    """
+    return peak Python memory (bytes) of function()
+    """
+    env.flush_all()
+    env.invalidate_all()
+    tracemalloc.start()
+    try:
+        function()
+        env.flush_all()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'memory': peak}
+
+
+def run_export(env, bills, measure_function, function) -> dict:
+    """
+    return measure_function(env, function) with row cache of the bills cleared before
+    and changes of the export (batch, attachment, stored rows) rolled back after
+    """
+    env.flush_all()
+    env.cr.execute('SAVEPOINT bank_payment_measure')
+    env.cr.execute("""
+        UPDATE account_move SET bank_payment_row = NULL, bank_payment_fingerprint = NULL WHERE id IN %s
+    """, [tuple(bills.ids)])
+    result = measure_function(env, function)
+    env.cr.execute('ROLLBACK TO SAVEPOINT bank_payment_measure')
+    env.invalidate_all()
+    return result
+
+
+def measure_export(env, bills, function) -> dict:
+    """
+    return wall time, SQL query count (timed run) and peak Python memory (traced run) of export function()
+    """
+    return {
+        **run_export(env, bills, measure, function),
+        **run_export(env, bills, measure_memory, function),
+    }
+
+
+def run_size(env, size: int, mix: dict, seed: int) -> dict:
+    bills = create_bills(env, size, mix, random.Random(seed))
+    wizard = env['bank.payment'].with_context(active_model='account.move', active_ids=bills.ids).create({})
+    file_format = wizard._get_file_format(bills)
+    set_param = env['ir.config_parameter'].sudo().set_param
+    set_param('bank_payment.stream_downloads', 1)
+    can_stream = wizard._can_stream_download(bills, file_format)
+    # download generates the whole file in the action, streamed file is measured separately
+    set_param('bank_payment.stream_downloads', 0)
+
+    results = {
+        'write_files': measure_export(env, bills, lambda: wizard._write_bank_payment_files(bills, file_format)),
+        'download': measure_export(env, bills, wizard.action_download_bank_payment),
+    }
+    if can_stream:
+        results['stream'] = measure_export(
+            env, bills, lambda: sum(map(len, wizard._iter_bank_payment_stream(bills, archive=True))))
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    return list of regressions against baseline
+    """
+    regressions = []
+    for size, stages in results.items():
+        for stage, metrics in stages.items():
+            expected = baseline.get(size, {}).get(stage)
+            if not expected:
+                continue
+            for metric in METRICS:
+                if metrics[metric] > expected[metric] * (1 + tolerance):
+                    regressions.append(
+                        f"{size} bills, {stage}: {metric} {metrics[metric]} > baseline {expected[metric]}")
+    return regressions
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv if argv is not None else sys.argv[1:])
+    config.parse_config(['-c', args.config] if args.config else [])
+
+    results = {}
+    with Registry(args.database).cursor() as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+        try:
+            for size in args.sizes:
+                # data of each size is rolled back, so volumes do not add up
+                cr.execute('SAVEPOINT bank_payment_benchmark')
+                results[str(size)] = run_size(env, size, args.mix, args.seed)
+                env.flush_all()
+                cr.execute('ROLLBACK TO SAVEPOINT bank_payment_benchmark')
+                env.invalidate_all()
+        finally:
+            cr.rollback()
+
+    print(json.dumps(results, indent=4))
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if args.update_baseline:
+        baseline.update(results)
+        with open(BASELINE_PATH, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+        return 0
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION: {regression}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+import itertools
+
+from odoo import http
+from odoo.http import request, content_disposition
+
+from odoo.addons.bank_payment.wizard.bank_payment import _stream_bank_payment
+
+
+class BankPaymentController(http.Controller):
+
+    @http.route('/bank_payment/download/<int:wizard_id>', type='http', auth='user')
+    def download_bank_payment(self, wizard_id: int, **kwargs):
+        """
+        Send bank payment file while its rows are rendered (file is generated with own cursor).
+        Bills are claimed and the first chunk of the file is rendered before the response is returned,
+        so problems found there (e.g. bills exported by another run) are reported as usual errors
+        instead of a broken download.
+        """
+        wizard = request.env['bank.payment'].browse(wizard_id).exists()
+        if not wizard or wizard.create_uid != request.env.user or not wizard.stream_move_ids:
+            return request.not_found()
+
+        move_ids = wizard.stream_move_ids
+        file_format = wizard._get_file_format(request.env['account.move'].browse(move_ids))
+        charset = wizard._get_file_charset(file_format)
+        archive = wizard._archive_streamed_downloads()
+        only_new = wizard.only_new_bills
+        # the same wizard can not start the download twice
+        wizard.stream_move_ids = False
+
+        chunks = _stream_bank_payment(
+            request.env.cr.dbname, request.env.uid, dict(request.env.context), move_ids, archive, only_new)
+        first_chunk = next(chunks)
+        return request.make_response(
+            itertools.chain([first_chunk], chunks),
+            headers=[
+                ('Content-Type', f'{file_format.mimetype}; charset={charset}'),
+                ('Content-Disposition', content_disposition(f'bank_payment.{file_format.file_extension}')),
+                # send chunks as they are generated, without buffering in proxy
+                ('X-Accel-Buffering', 'no'),
+            ])
@@ -0,0 +1,21 @@
+from odoo.exceptions import UserError
+
+
+class BankPaymentDataError(UserError):
+    """
+    Raised when bill is missing data needed for bank payment file
+    """
+
+    def __init__(self, move_name: str, field_name: str):
+        self.move_name = move_name
+        self.field_name = field_name
+        super().__init__(f"""
+        Insufficient data!!
+        Invoice number: {move_name}
+        Missing field: {field_name}
+        """)
+
+    def __reduce__(self):
+        # raised in worker processes of parallel export and pickled back to the parent,
+        # default pickling would call __init__ with the message only
+        return self.__class__, (self.move_name, self.field_name)
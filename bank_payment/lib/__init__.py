@@ -0,0 +1,2 @@
+from . import formats
+from . import pain001
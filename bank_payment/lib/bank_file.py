@@ -0,0 +1,784 @@
+"""
+Bank payment file format: comma separated records of quoted fixed-width fields
+(IB000000000000 header, IB0302... payments, IB999999999999 footer).
+
+Pure Python (no Odoo import), so the format can be used, tested and profiled
+without a database. The bank.payment wizard only turns bills into Payment
+records. From the command line a CSV or JSON dump of payments
+(columns/keys named as Payment fields, amount in cents) is turned into the file:
+
+    python bank_file.py payments.json -o bank_payment.txt
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, fields as dataclass_fields
+from operator import attrgetter
+import argparse
+import csv
+import datetime
+import json
+import mmap
+import os
+import shutil
+import sys
+import tempfile
+import unicodedata
+
+
+####################################################
+# LAYOUTS
+####################################################
+
+FIELD_RULES = {
+    'total_lines': (6, 'int'),
+    'total_amount': (13, 'int'),
+    'trans_type': (14, 'txt'),
+    'index': (4, 'int'),
+    'eksp_date': (8, 'int'),
+    'amount': (13, 'int'),
+    'currency': (3, 'txt'),
+    'from_type': (1, 'int'),
+    'from_account': (15, 'int'),
+    'transaction_type': (1, 'int'),
+    'cust_reg': (4, 'int'),
+    'cust_acc': (10, 'int'),
+    'recipient_acc_number': (34, 'txt'),
+    'swift_number': (11, 'txt'),
+    'transaction_option': (1, 'int'),
+    'journal_text': (35, 'txt'),
+    'transfer_type': (2, 'int'),
+    'name': (32, 'txt'),
+    'recipient': (35, 'txt'),
+    'street': (32, 'txt'),
+    'street2': (32, 'txt'),
+    'zip_code': (4, 'txt'),
+    'city': (32, 'txt'),
+    'recipient_street': (35, 'txt'),
+    'recipient_street2': (35, 'txt'),
+    'recipient_country': (35, 'txt'),
+    'journal_name': (35, 'txt'),
+    'notification_text': (35, 'txt'),
+    'document_reference': (35, 'txt'),
+    'payment_id': (19, 'txt'),
+    'card_code': (2, 'txt'),
+    'blank2': (2, 'txt'),
+    'blank3': (3, 'txt'),
+    'blank4': (4, 'txt'),
+    'blank6': (6, 'txt'),
+    'blank8': (8, 'txt'),
+    'blank10': (10, 'txt'),
+    'blank14': (14, 'txt'),
+    'blank16': (16, 'txt'),
+    'blank24': (24, 'txt'),
+    'blank32': (32, 'txt'),
+    'blank35': (35, 'txt'),
+    'blank45': (45, 'txt'),
+    'blank64': (64, 'txt'),
+    'blank75': (75, 'txt'),
+    'blank90': (90, 'txt'),
+    'blank215': (215, 'txt'),
+    'blank255': (255, 'txt'),
+}
+
+
+def compile_rule(length: int, rule_type: str, plus_sign: bool = False):
+    """
+    return function that pads/cuts value to the length of the rule and quotes it
+    'txt' values are padded with spaces on the right,
+    'int' values with zeros on the left (plus sign is added only to padded values)
+    """
+    if rule_type == 'txt':
+        return lambda value: f'"{value[:length].ljust(length)}"'
+
+    def format_int(value):
+        value = str(value)
+        if len(value) < length:
+            return f'"{value.rjust(length, "0")}+"' if plus_sign else f'"{value.rjust(length, "0")}"'
+        return f'"{value[:length]}"'
+
+    return format_int
+
+
+def _field(rule: str, key: str = None, plus_sign: bool = False) -> tuple:
+    """
+    field filled with record value under `key` (rule name by default)
+    """
+    return (key or rule, rule, plus_sign, None)
+
+
+def _const(rule: str, value: str) -> tuple:
+    """
+    field with constant value, rendered once when layout is compiled
+    """
+    return (None, rule, False, value)
+
+
+def _blank(length: int) -> tuple:
+    return _const(f'blank{length}', '')
+
+
+def _raw(key: str) -> tuple:
+    """
+    field written as it is (no quotes, no padding)
+    """
+    return (key, None, False, None)
+
+
+class RecordLayout:
+    """
+    Compiled record of the bank file.
+    Constant fields are rendered in advance, so the whole line is rendered
+    with one format operation over the variable fields only
+    """
+    __slots__ = ('code', 'keys', 'columns', 'raw_column', '_formatters', '_template')
+
+    def __init__(self, code: str, layout_fields: tuple):
+        self.code = code
+        # (key, rule type) of every column, key is None for constant fields
+        self.columns = tuple((key, FIELD_RULES[rule][1] if rule else None) for key, rule, plus_sign, value in layout_fields)
+        # index of the column written without quotes (None if there is none)
+        self.raw_column = next((index for index, (key, rule_type) in enumerate(self.columns)
+                                if key is not None and rule_type is None), None)
+        keys, formatters, parts = [], [], []
+        for key, rule, plus_sign, value in layout_fields:
+            if key is None:
+                parts.append(compile_rule(*FIELD_RULES[rule], plus_sign)(value).replace('%', '%%'))
+                continue
+
+            keys.append(key)
+            formatters.append(compile_rule(*FIELD_RULES[rule], plus_sign) if rule else str)
+            parts.append('%s')
+
+        self.keys = tuple(keys)
+        self._formatters = tuple((key, attrgetter(key), formatter) for key, formatter in zip(keys, formatters))
+        self._template = ','.join(parts)
+
+    def render(self, record, fragments: dict = None) -> str:
+        """
+        record: object with attributes named as layout keys (e.g. Payment)
+        fragments: already rendered fields by slot (see render_fragments), used instead of record values
+        """
+        if not fragments:
+            return self._template % tuple(formatter(getter(record)) for key, getter, formatter in self._formatters)
+
+        return self._template % tuple(
+            fragments[slot] if slot in fragments else formatter(getter(record))
+            for slot, (key, getter, formatter) in enumerate(self._formatters))
+
+    def render_fragments(self, record, keys: tuple) -> dict:
+        """
+        return {slot: rendered field} for fields filled from `keys`
+        """
+        return {
+            slot: formatter(getter(record))
+            for slot, (key, getter, formatter) in enumerate(self._formatters) if key in keys
+        }
+
+
+FIRST_LINE = RecordLayout('IB000000000000', (
+    _const('trans_type', 'IB000000000000'),
+    _field('eksp_date', 'creation_date'),
+    _blank(90),
+    _blank(255),
+    _blank(255),
+    _blank(255),
+))
+
+LAST_LINE = RecordLayout('IB999999999999', (
+    _const('trans_type', 'IB999999999999'),
+    _field('eksp_date', 'creation_date'),
+    _field('total_lines'),
+    _field('total_amount', plus_sign=True),
+    _blank(64),
+    _blank(255),
+    _blank(255),
+    _blank(255),
+))
+
+DOMESTIC = RecordLayout('IB030202000006', (
+    _const('trans_type', 'IB030202000006'),
+    _const('index', '0001'),
+    _field('eksp_date'),
+    _field('amount', plus_sign=True),
+    _field('currency'),
+    _field('from_type'),
+    _field('from_account'),
+    _const('transaction_type', '2'),
+    _field('cust_reg'),
+    _field('cust_acc'),
+    _field('transaction_option'),
+    _field('journal_text'),
+    _field('name'),
+    _field('street'),
+    _field('street2'),
+    _field('zip_code'),
+    _field('city'),
+    _raw('own_journal_number'),
+    _field('notification_text', 'notification_text1'),
+    _field('notification_text', 'notification_text2'),
+    _field('notification_text', 'notification_text3'),
+    _field('notification_text', 'notification_text4'),
+    _field('notification_text', 'notification_text5'),
+    _blank(35),
+    _field('document_reference'),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(3),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(6),
+    _blank(14),
+))
+
+INTERNATIONAL = RecordLayout('IB030204000004', (
+    _const('trans_type', 'IB030204000004'),
+    _const('index', '0001'),
+    _field('eksp_date'),
+    _field('amount', plus_sign=True),
+    _field('from_type'),
+    _field('from_account'),
+    _field('currency'),
+    _field('currency'),  # transfer currency
+    _field('transfer_type'),
+    _field('document_reference'),  # payment text 1
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _field('recipient', 'name'),
+    _field('recipient_street', 'street'),
+    _field('recipient_street2', 'street2'),
+    _field('recipient_country', 'country'),
+    _field('recipient_acc_number'),
+    _field('swift_number'),
+    _blank(45),
+    _blank(75),
+    _blank(75),
+    _blank(24),
+    _blank(215),
+))
+
+PAYMENT_CARD = RecordLayout('IB030207000002', (
+    _const('trans_type', 'IB030207000002'),
+    _const('index', '0001'),
+    _field('eksp_date'),
+    _field('amount', plus_sign=True),
+    _field('from_type'),
+    _field('from_account'),
+    _field('card_code'),
+    _field('payment_id', 'journal_text'),
+    _blank(4),
+    _blank(10),
+    _blank(8),
+    _field('name'),  # recipient name
+    _blank(32),
+    _field('document_reference'),  # journal nr
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(35),
+    _blank(16),
+    _blank(215),
+))
+
+RECORD_LAYOUTS = {layout.code: layout for layout in (DOMESTIC, INTERNATIONAL, PAYMENT_CARD)}
+
+# bank transfer type (account.fiscal.position) -> record type
+TRANS_TYPES = {
+    'domestic': DOMESTIC.code,
+    'international': INTERNATIONAL.code,
+    'payment_card': PAYMENT_CARD.code,
+}
+
+# values shared by all bills of one partner
+PARTNER_KEYS = ('name', 'street', 'street2', 'zip_code', 'city', 'country')
+
+####################################################
+# CACHE
+####################################################
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Cache with bounded size, least recently used entries are evicted first
+    """
+    __slots__ = ('max_size', '_data')
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    def get(self, key, compute):
+        """
+        return cached value of key, compute() it if it is not cached yet
+        """
+        value = self._data.get(key, _MISSING)
+        if value is not _MISSING:
+            self._data.move_to_end(key)
+            return value
+
+        value = self._data[key] = compute()
+        if len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+        return value
+
+
+class ExportCache:
+    """
+    Values computed once per export and reused for all bills:
+    formatted dates, company accounts and rendered partner fields (by partner and record type)
+    """
+    __slots__ = ('dates', 'companies', 'partners')
+
+    def __init__(self, max_size: int = 10000):
+        self.dates = LRUCache(max_size)
+        self.companies = LRUCache(max_size)
+        self.partners = LRUCache(max_size)
+
+
+####################################################
+# RECORDS
+####################################################
+
+@dataclass(slots=True)
+class Payment:
+    """
+    Raw (not formatted) values of one payment row, named as layout keys
+    """
+    trans_type: str = DOMESTIC.code
+    eksp_date: str = ''
+    amount: int = 0  # in cents
+    currency: str = ''
+    from_type: str = ''
+    from_account: str = ''
+    transaction_option: str = '1'
+    journal_text: str = ''
+    transfer_type: str = '53'
+    recipient_acc_number: str = ''
+    swift_number: str = ''
+    name: str = ''
+    street: str = ''
+    street2: str = ''
+    country: str = ''
+    zip_code: str = ''
+    city: str = ''
+    own_journal_number: str = ''
+    notification_text1: str = ''
+    notification_text2: str = ''
+    notification_text3: str = ''
+    notification_text4: str = ''
+    notification_text5: str = ''
+    document_reference: str = ''
+    cust_reg: str = ''
+    cust_acc: str = ''
+    card_code: str = ''
+    debtor_name: str = ''
+    debtor_bic: str = ''
+    country_code: str = ''
+    partner_id: int = None  # only used as cache key of rendered partner fields
+
+
+@dataclass(slots=True)
+class FileHeader:
+    creation_date: str
+    created_at: str = ''  # ISO date and time
+    initiating_party: str = ''
+
+
+@dataclass(slots=True)
+class FileFooter:
+    creation_date: str
+    total_lines: int
+    total_amount: int
+
+
+####################################################
+# ENCODING
+####################################################
+
+# charset of bank file expected by the bank
+DEFAULT_CHARSET = 'iso-8859-1'
+
+# one character replacements of characters the charset may not have
+# (one character each, so fixed-width fields keep their width)
+TRANSLITERATIONS = {
+    '\u00a0': ' ',
+    '\u2018': "'", '\u2019': "'", '\u201a': "'", '\u201c': "'", '\u201d': "'", '\u201e': "'",
+    '\u2013': '-', '\u2014': '-', '\u2026': '.', '\u20ac': 'E',
+    '\u00e6': 'a', '\u00c6': 'A', '\u00f8': 'o', '\u00d8': 'O', '\u00e5': 'a', '\u00c5': 'A',
+    '\u00df': 's', '\u0131': 'i', '\u0142': 'l', '\u0141': 'L', '\u0111': 'd', '\u0110': 'D',
+    '\u0153': 'o', '\u0152': 'O',
+}
+REPLACEMENT_CHARACTER = '?'
+
+
+class CharsetTable(dict):
+    """
+    str.translate table mapping every character to one character that is encoded
+    with exactly one byte in `charset`, so width in characters is width in bytes.
+    Characters the charset does not have are transliterated (TRANSLITERATIONS, then
+    base letter of accented character) or replaced with REPLACEMENT_CHARACTER,
+    control characters (line breaks, tabs) are replaced with space.
+    Latin-1 range is computed in advance, other characters on first use.
+    """
+    __slots__ = ('charset',)
+
+    def __init__(self, charset: str):
+        super().__init__()
+        self.charset = charset
+        for code in range(256):
+            self[code] = self._translate(chr(code))
+        for character in TRANSLITERATIONS:
+            self[ord(character)] = self._translate(character)
+
+    def __missing__(self, code: int) -> str:
+        value = self[code] = self._translate(chr(code))
+        return value
+
+    def _fits(self, character: str) -> bool:
+        try:
+            return len(character.encode(self.charset)) == 1
+        except UnicodeEncodeError:
+            return False
+
+    def _translate(self, character: str) -> str:
+        if unicodedata.category(character) == 'Cc':
+            return ' '
+        candidates = (character, TRANSLITERATIONS.get(character), unicodedata.normalize('NFKD', character)[:1])
+        return next((candidate for candidate in candidates if candidate and self._fits(candidate)),
+                    REPLACEMENT_CHARACTER)
+
+    def encode(self, line: str) -> bytes:
+        """
+        return line translated in one pass and encoded in charset.
+        Line of printable characters the charset has (each as one byte) is encoded as it is,
+        translation would not change it
+        """
+        if line.isprintable():
+            try:
+                data = line.encode(self.charset)
+            except UnicodeEncodeError:
+                pass
+            else:
+                if len(data) == len(line):
+                    return data
+        return line.translate(self).encode(self.charset)
+
+
+_charset_tables = {}
+
+
+def get_charset_table(charset: str = DEFAULT_CHARSET) -> CharsetTable:
+    """
+    return translation table of charset (shared by all files written in it)
+    """
+    if charset not in _charset_tables:
+        _charset_tables[charset] = CharsetTable(charset)
+    return _charset_tables[charset]
+
+
+####################################################
+# FILE
+####################################################
+
+def render_payment(payment: Payment, cache: ExportCache = None) -> str:
+    """
+    return rendered row of payment
+    """
+    layout = RECORD_LAYOUTS.get(payment.trans_type)
+    if not layout:
+        raise ValueError(f"Unknown transaction type: {payment.trans_type}")
+
+    if cache is None or payment.partner_id is None:
+        return layout.render(payment)
+
+    fragments = cache.partners.get(
+        (payment.partner_id, layout.code), lambda: layout.render_fragments(payment, PARTNER_KEYS))
+    return layout.render(payment, fragments)
+
+
+def iter_bank_file(payments, creation_date: str, cache: ExportCache = None):
+    """
+    Yield lines of bank file (without line separators)
+    return: (total lines, total amount)
+    """
+    cache = cache or ExportCache()
+    yield FIRST_LINE.render(FileHeader(creation_date))
+
+    total_lines = 0
+    total_amount = 0
+    for payment in payments:
+        yield render_payment(payment, cache)
+        total_lines += 1
+        total_amount += payment.amount
+
+    yield LAST_LINE.render(FileFooter(creation_date, total_lines, total_amount))
+    return total_lines, total_amount
+
+
+def write_bank_file(payments, stream, creation_date: str, charset: str = DEFAULT_CHARSET) -> tuple:
+    """
+    Write bank file into binary stream
+    return: (total lines, total amount)
+    """
+    table = get_charset_table(charset)
+    lines = iter_bank_file(payments, creation_date)
+    separator = b''
+    while True:
+        try:
+            line = next(lines)
+        except StopIteration as stop:
+            return stop.value
+
+        stream.write(separator)
+        stream.write(table.encode(line))
+        separator = b'\n'
+
+
+# largest total amount footer of one file can hold
+MAX_FILE_AMOUNT = 10 ** FIELD_RULES['total_amount'][0] - 1
+
+# files bigger than this are spooled to disk while being generated
+SPOOL_MAX_SIZE = 10 * 1024 * 1024
+
+
+class BankFileSplitter:
+    """
+    Write rendered rows into as many framed files as needed, so that no file
+    has more than max_lines rows (0 = no limit) or total amount above max_amount
+    """
+    __slots__ = ('open_stream', 'first_line', 'last_line', 'max_lines', 'max_amount', 'table',
+                 'header_needs_totals', 'files', '_stream', '_rows', '_total_lines', '_total_amount')
+
+    def __init__(self, open_stream, first_line, last_line, max_lines: int = 0,
+                 max_amount: int = MAX_FILE_AMOUNT, charset: str = DEFAULT_CHARSET,
+                 header_needs_totals: bool = False):
+        """
+        open_stream(): return new binary stream for next file
+        first_line(total_lines, total_amount), last_line(total_lines, total_amount): return header and footer of file
+        header_needs_totals: header is written once all rows of the file are known
+        (rows are spooled to temporary file meanwhile), otherwise it gets zero totals
+        """
+        self.table = get_charset_table(charset)
+        self.open_stream = open_stream
+        self.first_line = first_line
+        self.last_line = last_line
+        self.max_lines = max_lines
+        self.max_amount = min(max_amount or MAX_FILE_AMOUNT, MAX_FILE_AMOUNT)
+        self.header_needs_totals = header_needs_totals
+        # (stream, total lines, total amount) of every finished file
+        self.files = []
+        self._stream = None
+        self._rows = None
+        self._total_lines = 0
+        self._total_amount = 0
+
+    def _open(self) -> None:
+        self._stream = self.open_stream()
+        if self.header_needs_totals:
+            self._rows = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+        else:
+            self._rows = self._stream
+            self._stream.write(self.table.encode(self.first_line(0, 0)))
+        self._total_lines = 0
+        self._total_amount = 0
+
+    def _close(self) -> None:
+        if self.header_needs_totals:
+            self._stream.write(self.table.encode(self.first_line(self._total_lines, self._total_amount)))
+            self._rows.seek(0)
+            shutil.copyfileobj(self._rows, self._stream)
+            self._rows.close()
+        self._stream.write(b'\n')
+        self._stream.write(self.table.encode(self.last_line(self._total_lines, self._total_amount)))
+        self.files.append((self._stream, self._total_lines, self._total_amount))
+        self._stream = None
+        self._rows = None
+
+    def write(self, line: str, amount: int) -> None:
+        """
+        Write one payment row (row is never split, so a row above max_amount gets a file of its own)
+        """
+        if self._stream is None:
+            self._open()
+        elif self._total_lines and ((self.max_lines and self._total_lines >= self.max_lines)
+                                    or self._total_amount + amount > self.max_amount):
+            self._close()
+            self._open()
+
+        self._rows.write(b'\n')
+        self._rows.write(self.table.encode(line))
+        self._total_lines += 1
+        self._total_amount += amount
+
+    def close(self) -> list:
+        """
+        Write footer of last file (file without rows is written if there were none)
+        return: (stream, total lines, total amount) of every file
+        """
+        if self._stream is None and not self.files:
+            self._open()
+        if self._stream is not None:
+            self._close()
+        return self.files
+
+
+####################################################
+# READER
+####################################################
+
+# record attributes parsed as numbers
+INT_KEYS = ('amount', 'total_lines', 'total_amount')
+
+
+def _parse_int(value: str) -> int:
+    return int(value.rstrip('+').lstrip('0') or '0')
+
+
+def parse_line(line: str):
+    """
+    return typed record (FileHeader, Payment or FileFooter) of one line of bank file
+    """
+    columns = next(csv.reader([line]))
+    code = columns[0]
+    if code == FIRST_LINE.code:
+        layout, record = FIRST_LINE, FileHeader(creation_date='')
+    elif code == LAST_LINE.code:
+        layout, record = LAST_LINE, FileFooter(creation_date='', total_lines=0, total_amount=0)
+    elif code in RECORD_LAYOUTS:
+        layout, record = RECORD_LAYOUTS[code], Payment(trans_type=code)
+    else:
+        raise ValueError(f"Unknown record type: {code}")
+
+    extra = len(columns) - len(layout.columns)
+    if extra > 0 and layout.raw_column is not None:
+        # raw column is not quoted, so commas of its value split it into several columns
+        start = layout.raw_column
+        columns[start:start + extra + 1] = [','.join(columns[start:start + extra + 1])]
+
+    if len(columns) != len(layout.columns):
+        raise ValueError(f"Record {code} should have {len(layout.columns)} fields, not {len(columns)}")
+
+    for (key, rule_type), value in zip(layout.columns, columns):
+        if key is None:
+            continue
+        if key in INT_KEYS:
+            value = _parse_int(value)
+        elif rule_type == 'txt':
+            value = value.rstrip(' ')
+        setattr(record, key, value)
+
+    return record
+
+
+def read_bank_file(path: str, charset: str = DEFAULT_CHARSET):
+    """
+    Yield typed records of bank file one by one. File is memory-mapped, not loaded whole.
+    """
+    with open(path, 'rb') as bank_file:
+        if not os.fstat(bank_file.fileno()).st_size:
+            return
+        with mmap.mmap(bank_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            for line in iter(mapped.readline, b''):
+                line = line.rstrip(b'\r\n')
+                if line:
+                    yield parse_line(line.decode(charset))
+
+
+def check_bank_file(path: str, on_payment=None, charset: str = DEFAULT_CHARSET) -> dict:
+    """
+    Check bank file in one pass: header first, footer last,
+    footer total_lines and total_amount equal to payment rows.
+    on_payment: called with every payment (e.g. to collect them for matching)
+    return: {'header', 'footer', 'total_lines', 'total_amount', 'errors'}
+    """
+    result = {'header': None, 'footer': None, 'total_lines': 0, 'total_amount': 0, 'errors': []}
+    errors = result['errors']
+    for line_number, record in enumerate(read_bank_file(path, charset), 1):
+        if result['footer']:
+            errors.append(f"Line {line_number}: record after footer")
+        if isinstance(record, FileHeader):
+            if line_number != 1:
+                errors.append(f"Line {line_number}: header is not first line")
+            result['header'] = record
+        elif isinstance(record, FileFooter):
+            result['footer'] = record
+        else:
+            result['total_lines'] += 1
+            result['total_amount'] += record.amount
+            if on_payment:
+                on_payment(record)
+
+    footer = result['footer']
+    if not result['header']:
+        errors.append("Header is missing")
+    if not footer:
+        errors.append("Footer is missing")
+    else:
+        if footer.total_lines != result['total_lines']:
+            errors.append(f"Footer total_lines {footer.total_lines} != {result['total_lines']} payment rows")
+        if footer.total_amount != result['total_amount']:
+            errors.append(f"Footer total_amount {footer.total_amount} != {result['total_amount']} sum of payment rows")
+
+    return result
+
+
+####################################################
+# COMMAND LINE
+####################################################
+
+PAYMENT_FIELDS = {field.name: field.type for field in dataclass_fields(Payment)}
+
+
+def _to_payment(values: dict) -> Payment:
+    values = {key: value for key, value in values.items() if key in PAYMENT_FIELDS and value not in (None, '')}
+    if 'amount' in values:
+        values['amount'] = int(values['amount'])
+    return Payment(**{key: value if key == 'amount' else str(value) for key, value in values.items()})
+
+
+def read_payments(path: str):
+    """
+    Yield payments from JSON (list of objects) or CSV (with header) file
+    """
+    if path.endswith('.json'):
+        with open(path, encoding='utf-8') as payments_file:
+            yield from map(_to_payment, json.load(payments_file))
+    else:
+        with open(path, newline='', encoding='utf-8') as payments_file:
+            yield from map(_to_payment, csv.DictReader(payments_file))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Generate bank payment file from CSV or JSON dump of payments")
+    parser.add_argument('payments', help="CSV or JSON file with payments (amount in cents)")
+    parser.add_argument('-o', '--output', help="Output file (default: stdout)")
+    parser.add_argument('--date', default=datetime.date.today().strftime('%Y%m%d'),
+                        help="Creation date of the file, YYYYMMDD (default: today)")
+    parser.add_argument('--charset', default=DEFAULT_CHARSET,
+                        help=f"Charset expected by the bank (default: {DEFAULT_CHARSET})")
+    args = parser.parse_args(argv)
+
+    payments = read_payments(args.payments)
+    if args.output:
+        with open(args.output, 'wb') as stream:
+            total_lines, total_amount = write_bank_file(payments, stream, args.date, args.charset)
+    else:
+        total_lines, total_amount = write_bank_file(payments, sys.stdout.buffer, args.date, args.charset)
+
+    print(f"{total_lines} payments, total amount {total_amount}", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,79 @@
+"""
+Helpers of export runs shared by the bank.payment wizard, background jobs
+and batches: stage metrics, stream of downloaded file and shared constants.
+
+Pure Python (no Odoo import), like the rest of lib.
+"""
+from contextlib import contextmanager
+import time
+
+# bills rendered by one worker process in parallel export
+SHARD_SIZE = 2000
+
+# streamed download is sent in chunks of about this size (bytes)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# models owning exported files (attachments of other models are never reused)
+EXPORT_ATTACHMENT_MODELS = ('bank.payment.batch', 'bank.payment.job')
+
+
+####################################################
+# METRICS
+####################################################
+
+class ExportMetrics:
+    """
+    Duration, SQL query count and row count of export stages
+    """
+    __slots__ = ('cr', 'stages')
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.stages = {}
+
+    def add(self, name: str, duration: float = 0.0, query_count: int = 0, row_count: int = 0) -> None:
+        stage = self.stages.setdefault(name, {'duration': 0.0, 'query_count': 0, 'row_count': 0})
+        stage['duration'] += duration
+        stage['query_count'] += query_count
+        stage['row_count'] += row_count
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        measure code inside `with` block as stage `name`
+        """
+        query_count = self.cr.sql_log_count
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, self.cr.sql_log_count - query_count)
+
+
+####################################################
+# STREAMING
+####################################################
+
+class StreamBuffer:
+    """
+    Binary stream collecting written data until it is taken for sending
+    (and copying it into archive stream, if given)
+    """
+    __slots__ = ('chunks', 'size', 'archive')
+
+    def __init__(self, archive=None):
+        self.chunks = []
+        self.size = 0
+        self.archive = archive
+
+    def write(self, data: bytes) -> None:
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.archive is not None:
+            self.archive.write(data)
+
+    def take(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
@@ -0,0 +1,150 @@
+"""
+Registry of bank file formats.
+
+A format renders Payment records of the bank transfer types it supports
+(bank_trans_type of account.fiscal.position) and frames them with its own
+first and last line. Formats are registered by code with `register_format`
+and selected by the paying bank account (res.partner.bank) of the bills.
+
+Checks and values specific to a format are provided by the format too:
+they are built with getters of the exporter (bank.payment wizard), which take
+prefetched values of one bill and raise error naming missing field.
+"""
+from .bank_file import (
+    DEFAULT_CHARSET, FIRST_LINE, LAST_LINE, TRANS_TYPES,
+    ExportCache, FileFooter, FileHeader, Payment, check_bank_file, render_payment,
+)
+
+# code -> format
+FORMATS = {}
+
+DEFAULT_FORMAT = 'ib'
+
+
+def register_format(format_class):
+    """
+    class decorator adding one instance of the format to the registry
+    """
+    FORMATS[format_class.code] = format_class()
+    return format_class
+
+
+def get_format(code: str = None) -> 'BankFileFormat':
+    """
+    return registered format (default format if code is empty)
+    """
+    try:
+        return FORMATS[code or DEFAULT_FORMAT]
+    except KeyError:
+        raise ValueError(f"Unknown bank file format: {code}")
+
+
+class BankFileFormat:
+    """
+    Bank file format plugin
+    """
+    code = None
+    name = None
+    file_extension = 'txt'
+    mimetype = 'text/plain'
+    # charset required by the format (None: charset configured for the bank)
+    charset = None
+    # first line contains totals of the file, so it is written after the rows
+    header_needs_totals = False
+    # bank transfer type -> record type of the format (Payment.trans_type)
+    trans_types = {}
+    # written files can be read back and checked (check_file is implemented)
+    can_check_file = False
+
+    def get_record_type(self, trans_type: str) -> str:
+        """
+        return record type of bank transfer type (None if format does not support it)
+        """
+        return self.trans_types.get(trans_type)
+
+    def get_checks(self, exporter, bill: dict) -> list:
+        """
+        return checks of bill values required by the format (exporter getters called with the bill)
+        """
+        return []
+
+    def set_payment_values(self, exporter, bill: dict, payment: Payment, cache: ExportCache) -> None:
+        """
+        Fill values of payment specific to the format (values common to all formats are set by exporter)
+        """
+
+    def render_payment(self, payment: Payment, cache: ExportCache = None) -> str:
+        """
+        return rendered row of payment (one line)
+        """
+        raise NotImplementedError()
+
+    def first_line(self, header: FileHeader, footer: FileFooter) -> str:
+        raise NotImplementedError()
+
+    def last_line(self, header: FileHeader, footer: FileFooter) -> str:
+        raise NotImplementedError()
+
+    def check_file(self, path: str, on_payment=None, charset: str = DEFAULT_CHARSET) -> dict:
+        """
+        Read file back and check its totals (see bank_file.check_bank_file)
+        """
+        raise NotImplementedError(f"Files in {self.name} format can not be read back")
+
+
+@register_format
+class IBFormat(BankFileFormat):
+    """
+    Comma separated records of quoted fixed-width fields (see bank_file)
+    """
+    code = 'ib'
+    name = 'IB (fixed-width CSV)'
+    trans_types = TRANS_TYPES
+    can_check_file = True
+
+    def get_checks(self, exporter, bill: dict) -> list:
+        checks = [
+            exporter._get_from_type,
+            exporter._get_from_account,
+            exporter._get_payment_reference,
+            exporter._get_recipient_acc_number,
+            exporter._get_notification_text,
+            exporter._get_document_reference,
+        ]
+        trans_type = exporter._get_trans_type(bill)
+        if trans_type == 'domestic':
+            checks.append(exporter._get_partner_acc_number)
+        elif trans_type == 'payment_card':
+            checks.append(exporter._get_card_code)
+
+        return checks
+
+    def set_payment_values(self, exporter, bill: dict, payment: Payment, cache: ExportCache) -> None:
+        payment.from_type = exporter._get_from_type(bill)
+        payment.from_account = cache.companies.get(bill['company_id'], lambda: exporter._get_from_account(bill))
+        payment.transaction_option = exporter._get_transaction_option(bill)
+        payment.transfer_type = exporter._get_transfer_type(bill)
+        (payment.notification_text1, payment.notification_text2, payment.notification_text3,
+         payment.notification_text4, payment.notification_text5) = exporter._get_notification_text(bill)
+        payment.document_reference = exporter._get_document_reference(bill)
+
+        trans_type = exporter._get_trans_type(bill)
+        if trans_type == 'domestic':
+            partner_acc_number = exporter._get_partner_acc_number(bill)
+            payment.cust_reg = partner_acc_number[:4]
+            payment.cust_acc = partner_acc_number[4:]
+
+        elif trans_type == 'payment_card':
+            payment.card_code = exporter._get_card_code(bill)  # Specific for Payment card only
+
+    def render_payment(self, payment: Payment, cache: ExportCache = None) -> str:
+        return render_payment(payment, cache)
+
+    def first_line(self, header: FileHeader, footer: FileFooter) -> str:
+        return FIRST_LINE.render(header)
+
+    def last_line(self, header: FileHeader, footer: FileFooter) -> str:
+        return LAST_LINE.render(footer)
+
+    def check_file(self, path: str, on_payment=None, charset: str = DEFAULT_CHARSET) -> dict:
+        return check_bank_file(path, on_payment, charset)
@@ -0,0 +1,195 @@
+"""
+SEPA / ISO 20022 customer credit transfer initiation (pain.001.001.03).
+
+Every payment is written as its own <PmtInf> block (with its own requested
+execution date and debtor account), so rows do not depend on each other and
+the XML is written row by row, without building the document in memory.
+Group header holds number of transactions and control sum of the file,
+so it is written after the rows.
+Files are read back with iterparse, one <PmtInf> block at a time.
+"""
+import re
+import uuid
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, quoteattr
+
+from .bank_file import DEFAULT_CHARSET, ExportCache, FileFooter, FileHeader, Payment
+from .formats import BankFileFormat, register_format
+
+NAMESPACE = 'urn:iso:std:iso:20022:tech:xsd:pain.001.001.03'
+
+IBAN_PATTERN = re.compile(r'^[A-Z]{2}[0-9]{2}[A-Z0-9]{1,30}$')
+
+
+def _text(value: str, length: int) -> str:
+    """
+    return value cut to the length and escaped for XML
+    """
+    return escape((value or '')[:length])
+
+
+def _amount(cents: int) -> str:
+    return f'{cents // 100}.{cents % 100:02d}'
+
+
+def _date(value: str) -> str:
+    """
+    return YYYYMMDD date as ISO date
+    """
+    return f'{value[:4]}-{value[4:6]}-{value[6:8]}'
+
+
+def _cents(amount: str) -> int:
+    """
+    return decimal amount of the file in cents
+    """
+    units, _point, cents = amount.partition('.')
+    return int(units or '0') * 100 + int((cents + '00')[:2])
+
+
+def _tag(name: str) -> str:
+    return f'{{{NAMESPACE}}}{name}'
+
+
+def _find_text(element, path: str) -> str:
+    return element.findtext('/'.join(map(_tag, path.split('/'))), '').strip()
+
+
+def _account(number: str) -> str:
+    """
+    return account identification (IBAN, or other identification for local account numbers)
+    """
+    number = (number or '').replace(' ', '').upper()
+    if IBAN_PATTERN.match(number):
+        return f'<Id><IBAN>{number}</IBAN></Id>'
+    return f'<Id><Othr><Id>{_text(number, 34)}</Id></Othr></Id>'
+
+
+def _agent(bic: str) -> str:
+    if bic:
+        return f'<FinInstnId><BIC>{_text(bic.replace(" ", ""), 11)}</BIC></FinInstnId>'
+    return '<FinInstnId><Othr><Id>NOTPROVIDED</Id></Othr></FinInstnId>'
+
+
+@register_format
+class Pain001Format(BankFileFormat):
+    code = 'pain001'
+    name = 'SEPA / ISO 20022 pain.001'
+    file_extension = 'xml'
+    mimetype = 'application/xml'
+    charset = 'utf-8'
+    header_needs_totals = True
+    can_check_file = True
+    trans_types = {
+        'domestic': 'domestic',
+        'international': 'international',
+    }
+
+    def get_checks(self, exporter, bill: dict) -> list:
+        return [
+            exporter._get_debtor_account,
+            exporter._get_payment_reference,
+            exporter._get_recipient_acc_number,
+        ]
+
+    def set_payment_values(self, exporter, bill: dict, payment: Payment, cache: ExportCache) -> None:
+        payment.from_account = exporter._get_debtor_account(bill)
+        payment.debtor_name = bill['company_name'] or ''
+        payment.debtor_bic = bill['company_bic'] or ''
+        payment.country_code = bill['country_code'] or ''
+
+    def render_payment(self, payment: Payment, cache: ExportCache = None) -> str:
+        address = ''.join(
+            f'<AdrLine>{_text(line, 70)}</AdrLine>'
+            for line in (payment.street, ' '.join(filter(None, (payment.zip_code, payment.city)))) if line)
+        if payment.country_code:
+            address = f'<Ctry>{_text(payment.country_code, 2)}</Ctry>{address}'
+
+        return ''.join((
+            '<PmtInf>',
+            f'<PmtInfId>{_text(payment.own_journal_number, 35)}</PmtInfId>',
+            '<PmtMtd>TRF</PmtMtd>',
+            '<NbOfTxs>1</NbOfTxs>',
+            f'<CtrlSum>{_amount(payment.amount)}</CtrlSum>',
+            f'<ReqdExctnDt>{_date(payment.eksp_date)}</ReqdExctnDt>',
+            f'<Dbtr><Nm>{_text(payment.debtor_name, 70)}</Nm></Dbtr>',
+            f'<DbtrAcct>{_account(payment.from_account)}</DbtrAcct>',
+            f'<DbtrAgt>{_agent(payment.debtor_bic)}</DbtrAgt>',
+            '<ChrgBr>SLEV</ChrgBr>' if payment.currency == 'EUR' else '<ChrgBr>SHAR</ChrgBr>',
+            '<CdtTrfTxInf>',
+            f'<PmtId><EndToEndId>{_text(payment.own_journal_number, 35)}</EndToEndId></PmtId>',
+            f'<Amt><InstdAmt Ccy={quoteattr(payment.currency)}>{_amount(payment.amount)}</InstdAmt></Amt>',
+            f'<CdtrAgt>{_agent(payment.swift_number)}</CdtrAgt>',
+            f'<Cdtr><Nm>{_text(payment.name, 70)}</Nm>',
+            f'<PstlAdr>{address}</PstlAdr>' if address else '',
+            '</Cdtr>',
+            f'<CdtrAcct>{_account(payment.recipient_acc_number)}</CdtrAcct>',
+            f'<RmtInf><Ustrd>{_text(payment.journal_text, 140)}</Ustrd></RmtInf>',
+            '</CdtTrfTxInf>',
+            '</PmtInf>',
+        ))
+
+    def first_line(self, header: FileHeader, footer: FileFooter) -> str:
+        return ''.join((
+            '<?xml version="1.0" encoding="UTF-8"?>',
+            f'<Document xmlns="{NAMESPACE}">',
+            '<CstmrCdtTrfInitn>',
+            '<GrpHdr>',
+            f'<MsgId>{uuid.uuid4().hex}</MsgId>',
+            f'<CreDtTm>{header.created_at}</CreDtTm>',
+            f'<NbOfTxs>{footer.total_lines}</NbOfTxs>',
+            f'<CtrlSum>{_amount(footer.total_amount)}</CtrlSum>',
+            f'<InitgPty><Nm>{_text(header.initiating_party, 70)}</Nm></InitgPty>',
+            '</GrpHdr>',
+        ))
+
+    def last_line(self, header: FileHeader, footer: FileFooter) -> str:
+        return '</CstmrCdtTrfInitn></Document>'
+
+    def check_file(self, path: str, on_payment=None, charset: str = DEFAULT_CHARSET) -> dict:
+        """
+        Check file in one pass: group header is present and its NbOfTxs and CtrlSum
+        are equal to the payments (charset is declared by the XML itself)
+        """
+        result = {'header': None, 'footer': None, 'total_lines': 0, 'total_amount': 0, 'errors': []}
+        errors = result['errors']
+        try:
+            for _event, element in ElementTree.iterparse(path):
+                if element.tag == _tag('GrpHdr'):
+                    result['header'] = FileHeader(
+                        creation_date='',
+                        created_at=_find_text(element, 'CreDtTm'),
+                        initiating_party=_find_text(element, 'InitgPty/Nm'))
+                    result['footer'] = FileFooter(
+                        creation_date='',
+                        total_lines=int(_find_text(element, 'NbOfTxs') or '0'),
+                        total_amount=_cents(_find_text(element, 'CtrlSum')))
+                elif element.tag == _tag('PmtInf'):
+                    amount = element.find('/'.join(map(_tag, ('CdtTrfTxInf', 'Amt', 'InstdAmt'))))
+                    payment = Payment(
+                        trans_type='',
+                        eksp_date=_find_text(element, 'ReqdExctnDt').replace('-', ''),
+                        amount=_cents((amount.text or '').strip()) if amount is not None else 0,
+                        currency=amount.get('Ccy', '') if amount is not None else '',
+                        own_journal_number=_find_text(element, 'CdtTrfTxInf/PmtId/EndToEndId'),
+                        name=_find_text(element, 'CdtTrfTxInf/Cdtr/Nm'),
+                        journal_text=_find_text(element, 'CdtTrfTxInf/RmtInf/Ustrd'),
+                    )
+                    result['total_lines'] += 1
+                    result['total_amount'] += payment.amount
+                    if on_payment:
+                        on_payment(payment)
+                    element.clear()
+        except ElementTree.ParseError as error:
+            errors.append(f"File is not valid XML: {error}")
+
+        footer = result['footer']
+        if not footer:
+            errors.append("Group header is missing")
+        else:
+            if footer.total_lines != result['total_lines']:
+                errors.append(f"Group header NbOfTxs {footer.total_lines} != {result['total_lines']} payments")
+            if footer.total_amount != result['total_amount']:
+                errors.append(f"Group header CtrlSum {footer.total_amount} != {result['total_amount']} sum of payments")
+
+        return result
@@ -4,3 +4,6 @@ from . import account_move
 from . import account_fiscal_position
 from . import partner_bank
 from . import account_payment_term
+from . import bank_payment_job
+from . import bank_payment_log
+from . import bank_payment_batch
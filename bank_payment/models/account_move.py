@@ -1,10 +1,244 @@
 # -*- coding: utf-8 -*-
+import time
+
 from odoo import models, fields, api
+from odoo.osv import expression
+from odoo.tools import html2plaintext, split_every
+
+NOTIFICATION_LINES = 5
+NOTIFICATION_LINE_LENGTH = 35
+# cron run stops recomputing readiness after this many seconds and re-triggers itself
+READY_RECOMPUTE_TIME_BUDGET = 120
+# export links set on bills by SQL (see _set_bank_payment_links)
+BANK_PAYMENT_LINK_FIELDS = ('bank_payment_batch_id', 'bank_payment_job_id')
 
 
 class AccountMove(models.Model):
     _inherit = 'account.move'
 
+    bank_notification_text1 = fields.Char(compute='_compute_bank_notification', store=True)
+    bank_notification_text2 = fields.Char(compute='_compute_bank_notification', store=True)
+    bank_notification_text3 = fields.Char(compute='_compute_bank_notification', store=True)
+    bank_notification_text4 = fields.Char(compute='_compute_bank_notification', store=True)
+    bank_notification_text5 = fields.Char(compute='_compute_bank_notification', store=True)
+    bank_notification_valid = fields.Boolean(compute='_compute_bank_notification', store=True)
+    bank_notification_error = fields.Char(compute='_compute_bank_notification', store=True)
+    bank_payment_batch_id = fields.Many2one(
+        'bank.payment.batch', string='Bank Payment Batch', readonly=True, copy=False, index=True,
+        help="Last bank payment batch the bill was exported in")
+    bank_payment_row = fields.Text(
+        readonly=True, copy=False, prefetch=False,
+        help="Last rendered row of the bill in bank payment file (reused while fingerprint matches)")
+    bank_payment_fingerprint = fields.Char(readonly=True, copy=False, prefetch=False)
+    bank_payment_job_id = fields.Many2one(
+        'bank.payment.job', string='Bank Payment Job', readonly=True, copy=False, index=True,
+        help="Background bank payment export the bill is claimed by")
+    bank_payment_ready = fields.Boolean(
+        string='Ready for Bank Payment', compute='_compute_bank_payment_ready', store=True, index=True,
+        help="Bill has all data needed for bank payment file")
+    bank_payment_ready_reason = fields.Char(
+        string='Bank Payment Missing Data', compute='_compute_bank_payment_ready', store=True)
+    bank_payment_ready_outdated = fields.Boolean(
+        readonly=True, copy=False, index='btree_not_null',
+        help="Company bank accounts changed, readiness is recomputed in background")
+
+    @api.depends('narration')
+    def _compute_bank_notification(self):
+        """
+        Divide narration by paragraph into notification texts for bank payment
+        (max 5 paragraphs, max 35 characters each)
+        """
+        for move in self:
+            narration = html2plaintext(move.narration)
+            paragraphs = narration.split('\n') if narration else []
+            error = False
+            if len(paragraphs) > NOTIFICATION_LINES:
+                error = 'Narration (you can have max 5 paragraphs)'
+            else:
+                for i, paragraph in enumerate(paragraphs, 1):
+                    if len(paragraph) > NOTIFICATION_LINE_LENGTH:
+                        error = f'Narration (every paragraph should be max length of 35). Problematic paragraph: {i}'
+                        break
+
+            texts = [] if error else paragraphs
+            texts += [False] * (NOTIFICATION_LINES - len(texts))
+            move.update({f'bank_notification_text{i}': text for i, text in enumerate(texts, 1)})
+            move.bank_notification_valid = not error
+            move.bank_notification_error = error
+
+    @api.depends(
+        'move_type', 'state', 'payment_reference', 'invoice_origin', 'ref', 'bank_notification_error',
+        'fiscal_position_id.bank_trans_type', 'partner_bank_id.from_type', 'partner_bank_id.acc_number',
+        'partner_bank_id.card_code', 'partner_bank_id.bank_id.bic')
+    def _compute_bank_payment_ready(self):
+        """
+        Check vendor bills with the same rules as bank payment export (bills are read chunk by chunk).
+        Company bank accounts are not dependencies (one change would recompute all bills of the company
+        in the same request), their changes mark bills as outdated instead (see _outdate_bank_payment_ready)
+        """
+        bills = self.filtered(lambda move: move.id and move.move_type in ('in_invoice', 'in_refund'))
+        (self - bills).update({'bank_payment_ready': False, 'bank_payment_ready_reason': False})
+
+        wizard = self.env['bank.payment']
+        for ids in split_every(wizard._get_export_chunk_size(), bills.ids, list):
+            for bill in wizard._prefetch_bills(self.browse(ids)):
+                errors = wizard._get_bill_errors(bill)
+                self.browse(bill['id']).update({
+                    'bank_payment_ready': not errors,
+                    'bank_payment_ready_reason': ', '.join(errors) or False,
+                })
+
+    @api.model
+    def _outdate_bank_payment_ready(self, company_ids: list) -> None:
+        """
+        Mark vendor bills of companies whose bank accounts changed (paying account, its number or format),
+        their readiness is recomputed by cron and is not trusted by export meanwhile.
+        Only posted bills still to be paid are marked: readiness of draft bills is recomputed
+        when they are posted (state is a dependency), paid bills are not exported anymore.
+        """
+        if not company_ids:
+            return
+
+        self.env.cr.execute("""
+            UPDATE account_move
+               SET bank_payment_ready_outdated = true
+             WHERE company_id IN %s
+               AND move_type IN ('in_invoice', 'in_refund')
+               AND state = 'posted'
+               AND payment_state IN ('not_paid', 'partial')
+               AND bank_payment_ready_outdated IS NOT true
+        """, [tuple(company_ids)])
+        self.invalidate_model(['bank_payment_ready_outdated'])
+        self.env.ref('bank_payment.ir_cron_bank_payment_ready')._trigger()
+
+    @api.model
+    def _cron_recompute_bank_payment_ready(self) -> None:
+        """
+        Recompute readiness of outdated bills chunk by chunk, committing after every chunk
+        """
+        deadline = time.monotonic() + READY_RECOMPUTE_TIME_BUDGET
+        chunk_size = self.env['bank.payment']._get_export_chunk_size()
+        fnames = ['bank_payment_ready', 'bank_payment_ready_reason']
+        while True:
+            moves = self.search([('bank_payment_ready_outdated', '=', True)], order='id', limit=chunk_size)
+            if not moves:
+                return
+            if time.monotonic() > deadline:
+                self.env.ref('bank_payment.ir_cron_bank_payment_ready')._trigger()
+                return
+
+            for fname in fnames:
+                self.env.add_to_compute(self._fields[fname], moves)
+            moves.flush_recordset(fnames)
+            self.env.cr.execute("""
+                UPDATE account_move SET bank_payment_ready_outdated = NULL WHERE id IN %s
+            """, [tuple(moves.ids)])
+            self.env.cr.commit()
+            self.env.invalidate_all()
+
+    def _set_bank_payment_links(self, values: dict) -> None:
+        """
+        Set batch or job of bills with one SQL UPDATE (ORM write of posted bills runs
+        their write checks and recomputes, which export links do not need)
+        values: {field name: record id or False}, fields of BANK_PAYMENT_LINK_FIELDS only
+        """
+        if not self or not values:
+            return
+
+        fnames = list(values)
+        assert set(fnames) <= set(BANK_PAYMENT_LINK_FIELDS), f"Not a bank payment link: {fnames}"
+        self.flush_recordset(fnames)
+        assignments = ', '.join(f'{fname} = %s' for fname in fnames)
+        self.env.cr.execute(f"""
+            UPDATE account_move SET {assignments} WHERE id IN %s
+        """, [*(values[fname] or None for fname in fnames), tuple(self.ids)])
+        self.invalidate_recordset(fnames)
+
+    def _claim_bank_payment(self, job=None, only_new: bool = False) -> tuple:
+        """
+        Lock bills for one export run, skipping bills locked by another transaction
+        or claimed by another background job (so no bill is exported by two runs at once).
+        only_new: skip bills exported in a batch too, checked while they are locked
+        (batch of another run is committed before its locks are released)
+        Row locks are held until the end of transaction, bills claimed for a job
+        stay claimed until the job releases them.
+        return: (claimed bills, skipped bills), both in order of self
+        """
+        if not self:
+            return self, self
+
+        self.flush_recordset(['bank_payment_job_id', 'bank_payment_batch_id'])
+        self.env.cr.execute("""
+            SELECT id
+              FROM account_move
+             WHERE id IN %s
+               AND (bank_payment_job_id IS NULL OR bank_payment_job_id = %s)
+               AND (bank_payment_batch_id IS NULL OR NOT %s)
+               FOR UPDATE SKIP LOCKED
+        """, [tuple(self.ids), job.id if job else 0, only_new])
+        claimed_ids = {row[0] for row in self.env.cr.fetchall()}
+        claimed = self.filtered(lambda move: move.id in claimed_ids)
+        if job:
+            claimed._set_bank_payment_links({'bank_payment_job_id': job.id})
+
+        return claimed, self - claimed
+
+    def _release_bank_payment(self) -> None:
+        """
+        Release bills claimed by background job (after it is finished or failed)
+        """
+        self._set_bank_payment_links({'bank_payment_job_id': False})
+
+    @api.model
+    def _match_bank_payments(self, payments: list, matched_ids: set = None) -> list:
+        """
+        Match payment rows parsed from bank file to vendor bills in bulk,
+        by bill number, payment reference or bill reference (amount has to be equal too)
+        matched_ids: ids of bills matched already (by previous chunks of the file), updated with new matches
+        return: list of matched account.move ids (False if not matched), in order of payments
+        """
+        if not payments:
+            return []
+
+        names = {payment.own_journal_number for payment in payments if payment.own_journal_number}
+        payment_references = {payment.journal_text for payment in payments if payment.journal_text}
+        document_references = {payment.document_reference for payment in payments if payment.document_reference}
+        moves = self.search_read(expression.AND([
+            [('move_type', 'in', ('in_invoice', 'in_refund'))],
+            expression.OR([
+                [('name', 'in', list(names))],
+                [('payment_reference', 'in', list(payment_references))],
+                [('ref', 'in', list(document_references))],
+                [('invoice_origin', 'in', list(document_references))],
+            ]),
+        ]), ['name', 'payment_reference', 'ref', 'invoice_origin', 'amount_total'], order='id')
+
+        indexes = {'name': {}, 'payment_reference': {}, 'document_reference': {}}
+        for move in moves:
+            move['amount'] = int(move['amount_total'] * 100)
+            indexes['name'].setdefault(move['name'], []).append(move)
+            indexes['payment_reference'].setdefault(move['payment_reference'], []).append(move)
+            indexes['document_reference'].setdefault(move['invoice_origin'] or move['ref'], []).append(move)
+
+        matched_ids = set() if matched_ids is None else matched_ids
+        result = []
+        for payment in payments:
+            candidates = (
+                indexes['name'].get(payment.own_journal_number)
+                or indexes['payment_reference'].get(payment.journal_text)
+                or indexes['document_reference'].get(payment.document_reference)
+                or []
+            )
+            move_id = next((
+                move['id'] for move in candidates
+                if move['amount'] == payment.amount and move['id'] not in matched_ids
+            ), False)
+            if move_id:
+                matched_ids.add(move_id)
+            result.append(move_id)
+
+        return result
+
     def action_bank_payment(self):
         '''
         return: wizard bank payment window
@@ -0,0 +1,186 @@
+import itertools
+import logging
+import os
+import tempfile
+import zipfile
+from contextlib import contextmanager
+
+from odoo import models, fields, api, Command
+from odoo.exceptions import UserError
+from odoo.addons.bank_payment.lib.formats import DEFAULT_FORMAT, FORMATS, get_format
+from odoo.addons.bank_payment.lib.export import EXPORT_ATTACHMENT_MODELS, SHARD_SIZE
+
+_logger = logging.getLogger(__name__)
+
+# days bank payment files are kept (expired files of batches leave the batch and its file checksum)
+ATTACHMENT_RETENTION_DAYS = 90
+
+
+class BankPaymentBatch(models.Model):
+    _name = 'bank.payment.batch'
+    _description = 'Bills exported together in one bank payment file'
+    _order = 'id desc'
+
+    name = fields.Char(required=True, readonly=True,
+                       default=lambda self: f'Bank Payment {fields.Datetime.to_string(fields.Datetime.now())}')
+    move_ids = fields.Many2many('account.move', string='Bills', readonly=True)
+    move_count = fields.Integer(readonly=True)
+    total_lines = fields.Integer(readonly=True)
+    total_amount = fields.Float(
+        readonly=True, digits=(16, 2), help="Total amount of exported rows (summed without currency conversion)")
+    attachment_id = fields.Many2one('ir.attachment', readonly=True)
+    checksum = fields.Char(readonly=True, help="SHA1 checksum of exported file, kept once the file expires")
+    file_format = fields.Selection(
+        selection=lambda self: self.env['res.partner.bank']._get_bank_file_formats(),
+        default=DEFAULT_FORMAT, readonly=True)
+    can_verify = fields.Boolean(compute='_compute_can_verify', help="Stored file can be read back and checked")
+    verification_report = fields.Text(readonly=True)
+
+    @api.depends('attachment_id', 'file_format')
+    def _compute_can_verify(self):
+        for batch in self:
+            batch.can_verify = bool(batch.attachment_id) and get_format(batch.file_format).can_check_file
+
+    @api.model
+    def _create_batch(self, move_ids: models.Model, attachment: models.Model, total_lines: int, total_amount: int,
+                      file_format: str = DEFAULT_FORMAT):
+        """
+        Store exported file and mark its bills as exported
+        total_amount: in cents, as in the file
+        return: new batch
+        """
+        batch = self.create({
+            'move_ids': [Command.set(move_ids.ids)],
+            'move_count': len(move_ids),
+            'total_lines': total_lines,
+            'total_amount': total_amount / 100,
+            'attachment_id': attachment.id,
+            'checksum': attachment.checksum,
+            'file_format': file_format,
+        })
+        attachment.write({'res_model': self._name, 'res_id': batch.id})
+        move_ids._set_bank_payment_links({'bank_payment_batch_id': batch.id})
+        return batch
+
+    @contextmanager
+    def _open_bank_files(self):
+        """
+        yield paths of bank payment files stored in batch attachment
+        (files of zip archive are extracted into temporary directory)
+        """
+        self.ensure_one()
+        attachment = self.attachment_id
+        with tempfile.TemporaryDirectory() as directory:
+            if attachment.store_fname:
+                path = attachment._full_path(attachment.store_fname)
+            else:
+                path = os.path.join(directory, 'bank_payment')
+                with open(path, 'wb') as bank_file:
+                    bank_file.write(attachment.raw)
+
+            if attachment.mimetype != 'application/zip':
+                yield [path]
+                return
+
+            with zipfile.ZipFile(path) as archive:
+                names = sorted(archive.namelist())
+                archive.extractall(directory, names)
+            yield [os.path.join(directory, name) for name in names]
+
+    def _verify_files(self, paths: list) -> list:
+        """
+        Read stored files back, check their totals and match their rows to the batch bills.
+        Rows are matched in chunks of SHARD_SIZE while the files are read, so memory used
+        does not depend on the size of the files.
+        return: list of problems (empty if files match the batch)
+        """
+        errors = []
+        matched_ids = set()
+        # (file name, line number, payment) of rows read but not matched yet
+        pending = []
+
+        def match_pending():
+            move_ids = self.env['account.move']._match_bank_payments(
+                [payment for _file_name, _line_number, payment in pending], matched_ids)
+            for (file_name, line_number, payment), move_id in zip(pending, move_ids):
+                if not move_id:
+                    location = f"{file_name}, line {line_number}" if file_name else f"Line {line_number}"
+                    errors.append(
+                        f"{location}: no bill matches payment {payment.journal_text or payment.document_reference}")
+            pending.clear()
+
+        file_format = get_format(self.file_format)
+        charset = self.env['bank.payment']._get_file_charset(file_format)
+        for path in paths:
+            file_name = os.path.basename(path) if len(paths) > 1 else None
+            line_numbers = itertools.count(2)
+
+            def on_payment(payment, file_name=file_name, line_numbers=line_numbers):
+                pending.append((file_name, next(line_numbers), payment))
+                if len(pending) >= SHARD_SIZE:
+                    match_pending()
+
+            result = file_format.check_file(path, on_payment, charset)
+            errors.extend(f"{file_name}: {error}" if file_name else error for error in result['errors'])
+        match_pending()
+
+        missing = self.move_ids.filtered(lambda move: move.id not in matched_ids)
+        errors.extend(f"Bill {move.name} is not in the file" for move in missing)
+        return errors
+
+    def action_verify(self):
+        """
+        Parse stored files (without loading them whole) and compare them with the batch
+        """
+        for batch in self:
+            if not batch.attachment_id:
+                raise UserError(f"File of {batch.name} was streamed without being stored, it can not be verified.")
+            if not batch.can_verify:
+                batch.verification_report = f"Files in {get_format(batch.file_format).name} format can not be read back."
+                continue
+            with batch._open_bank_files() as paths:
+                errors = batch._verify_files(paths)
+            batch.verification_report = '\n'.join(errors) or 'File matches the batch.'
+
+    def action_download(self):
+        """
+        return: download stored bank payment file (without rendering it again)
+        """
+        self.ensure_one()
+        if not self.attachment_id:
+            raise UserError(f"File of {self.name} was streamed without being stored, it can not be downloaded again.")
+        return {
+            'type': 'ir.actions.act_url',
+            'name': 'Bank Payment',
+            'url': f'/web/content/{self.attachment_id.id}?download=true'
+        }
+
+    @api.autovacuum
+    def _gc_export_attachments(self) -> None:
+        """
+        Delete bank payment files older than retention period (including files exported before batches existed,
+        which have no owner). Batches of expired files are kept with checksum of the file,
+        files of unfinished jobs are kept.
+        """
+        days = int(self.env['ir.config_parameter'].sudo().get_param(
+            'bank_payment.attachment_retention_days', ATTACHMENT_RETENTION_DAYS))
+        names = ['bank_payment.zip'] + [f'bank_payment.{file_format.file_extension}' for file_format in FORMATS.values()]
+        attachments = self.env['ir.attachment'].sudo().search([
+            ('create_date', '<', fields.Datetime.subtract(fields.Datetime.now(), days=days)),
+            '|',
+            ('res_model', 'in', EXPORT_ATTACHMENT_MODELS),
+            '&', ('res_model', '=', False), ('name', 'in', names),
+        ])
+        kept_ids = set(self.env['bank.payment.job'].sudo().search(
+            [('attachment_id', 'in', attachments.ids), ('state', '!=', 'done')]).attachment_id.ids)
+        expired = attachments.filtered(lambda attachment: attachment.id not in kept_ids)
+
+        batches = self.sudo().search([('attachment_id', 'in', expired.ids)])
+        # batches created before checksum was stored
+        for batch in batches.filtered(lambda batch: not batch.checksum):
+            batch.checksum = batch.attachment_id.checksum
+        batches.attachment_id = False
+        self.env['bank.payment.job'].sudo().search([('attachment_id', 'in', expired.ids)]).attachment_id = False
+        _logger.info("Deleting %s bank payment file(s) older than %s days (%s of batches)",
+                     len(expired), days, len(batches))
+        expired.unlink()
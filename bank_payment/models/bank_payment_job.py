@@ -0,0 +1,386 @@
+import json
+import logging
+import time
+
+from odoo import models, fields, api, Command
+from odoo.addons.bank_payment.lib.export import SHARD_SIZE, ExportMetrics
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1000
+# cron run stops taking new chunks after this many seconds and re-triggers itself
+JOB_TIME_BUDGET = 120
+
+
+class BankPaymentJob(models.Model):
+    _name = 'bank.payment.job'
+    _description = 'Bank payment file generated in background'
+    _order = 'id desc'
+
+    name = fields.Char(required=True, default=lambda self: f'Bank Payment {fields.Datetime.to_string(fields.Datetime.now())}')
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ], default='pending', required=True, readonly=True)
+    move_ids = fields.Many2many('account.move', string='Bills', readonly=True)
+    move_count = fields.Integer(readonly=True)
+    only_new_bills = fields.Boolean(readonly=True, help="Bills exported in a batch meanwhile are left out")
+    skipped_move_ids = fields.Many2many(
+        'account.move', 'bank_payment_job_skipped_move_rel', 'job_id', 'move_id', string='Skipped Bills',
+        readonly=True, help="Bills left out, because another run was exporting them or exported them meanwhile")
+    processed_count = fields.Integer(readonly=True)
+    progress = fields.Float(compute='_compute_progress')
+    total_lines = fields.Integer(readonly=True)
+    total_amount = fields.Float(
+        readonly=True, digits=(16, 2), help="Total amount of rendered rows (summed without currency conversion)")
+    chunk_ids = fields.One2many('bank.payment.job.chunk', 'job_id', readonly=True)
+    attachment_id = fields.Many2one('ir.attachment', readonly=True)
+    log_id = fields.Many2one('bank.payment.log', readonly=True, help="Duration of export stages, summed over all chunks")
+    validation_report = fields.Text(readonly=True)
+    error = fields.Text(readonly=True)
+    domain = fields.Char(readonly=True, help="Domain bills were selected by (for exports without manual selection)")
+
+    @api.depends('move_count', 'processed_count')
+    def _compute_progress(self):
+        for job in self:
+            job.progress = 100.0 * job.processed_count / job.move_count if job.move_count else 0.0
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        jobs = super().create(vals_list)
+        for job in jobs:
+            job._claim_moves()
+        self.env.ref('bank_payment.ir_cron_bank_payment_job')._trigger()
+        return jobs
+
+    ####################################################
+    # CLAIMS
+    ####################################################
+
+    def _claim_moves(self) -> None:
+        """
+        Claim bills of the job, bills claimed by another export run are left out of the job.
+        If the set of bills changed, processing starts from the beginning.
+        """
+        self.ensure_one()
+        claimed, skipped = self.move_ids._claim_bank_payment(self, self.only_new_bills)
+        if skipped:
+            _logger.info("Bank payment job %s: %s bill(s) are exported by another run and were left out: %s",
+                         self.id, len(skipped), ', '.join(skipped.mapped('name')))
+            self.chunk_ids.unlink()
+            self.write({
+                'move_ids': [Command.set(claimed.ids)],
+                'skipped_move_ids': [Command.link(move.id) for move in skipped],
+                'processed_count': 0,
+                'total_lines': 0,
+                'total_amount': 0,
+            })
+            if self.log_id:
+                self.log_id.sudo().skipped_count = len(self.skipped_move_ids)
+        self.move_count = len(claimed)
+
+    def _release_moves(self) -> None:
+        self.move_ids.filtered(lambda move: move.bank_payment_job_id == self)._release_bank_payment()
+
+    ####################################################
+    # PROCESSING
+    ####################################################
+
+    def _get_chunk_size(self) -> int:
+        """
+        return bills per chunk (by default one shard per worker process, if chunks are rendered in parallel)
+        """
+        workers = self.env['bank.payment']._get_export_workers()
+        default = workers * SHARD_SIZE if workers > 1 else DEFAULT_CHUNK_SIZE
+        return int(self.env['ir.config_parameter'].sudo().get_param('bank_payment.job_chunk_size', default))
+
+    def _get_ordered_move_ids(self, offset: int = 0, limit: int = None) -> list:
+        """
+        return ids of bills claimed by the job ordered by company, then id, so bills of every company
+        (and its paying account) follow each other and chunks are assembled into files in the same order
+        """
+        self.env['account.move'].flush_model(['bank_payment_job_id', 'company_id'])
+        self.env.cr.execute("""
+            SELECT id
+              FROM account_move
+             WHERE bank_payment_job_id = %s
+          ORDER BY company_id, id
+            OFFSET %s
+             LIMIT %s
+        """, [self.id, offset, limit])
+        return [row[0] for row in self.env.cr.fetchall()]
+
+    def _process_chunk(self, chunk_size: int) -> None:
+        """
+        Render next chunk of bills (ordered by company, then id) and store its rows.
+        Once any chunk has invalid bills, the rest is only validated
+        so the report contains all problems.
+        """
+        self.ensure_one()
+        wizard = self.env['bank.payment']
+        metrics = ExportMetrics(self.env.cr)
+        move_ids = self._get_ordered_move_ids(self.processed_count, chunk_size)
+        lines, amounts, report = self._render_chunk(move_ids, metrics)
+
+        values = {'processed_count': self.processed_count + len(move_ids)}
+        if report or self.validation_report:
+            values['validation_report'] = '\n'.join(filter(None, [
+                self.validation_report,
+                wizard._format_validation_report(report),
+            ]))
+        else:
+            values.update({
+                'chunk_ids': [Command.create({
+                    'sequence': self.processed_count,
+                    'data': json.dumps(lines),
+                    'amounts': ' '.join(map(str, amounts)),
+                })],
+                'total_lines': self.total_lines + len(lines),
+                'total_amount': self.total_amount + sum(amounts) / 100,
+            })
+
+        # rows of the chunk are stored (serialized) in 'write' stage, framed into files when job is finalized
+        with metrics.stage('write'):
+            self.write(values)
+        metrics.add('write', row_count=len(lines))
+        self._add_metrics(metrics)
+
+    def _render_chunk(self, move_ids: list, metrics: ExportMetrics) -> tuple:
+        """
+        Validate and render bills of one chunk, in worker processes if configured
+        (see bank.payment._get_export_workers). Once the job has invalid bills, bills are only validated.
+        return: (rendered rows, their amounts, validation report)
+        """
+        wizard = self.env['bank.payment']
+        workers = wizard._get_export_workers()
+        if workers > 1 and len(move_ids) > SHARD_SIZE:
+            return wizard._render_bills_parallel(move_ids, workers, metrics)
+
+        lines, amounts, report, _rendered = wizard._render_bill_chunk(
+            move_ids, metrics, validate_only=bool(self.validation_report))
+        return lines, amounts, report
+
+    def _add_metrics(self, metrics: ExportMetrics) -> None:
+        if not self.log_id:
+            self.log_id = self.env['bank.payment.log']._log_export(
+                self.name, self.move_count, metrics, skipped_count=len(self.skipped_move_ids))
+        else:
+            self.log_id.sudo()._add_metrics(metrics)
+
+    def _iter_chunk_rows(self):
+        """
+        Yield stored rows and their amounts (in cents) chunk by chunk
+        """
+        for chunk in self.chunk_ids.sorted('sequence'):
+            lines = json.loads(chunk.data or '[]')
+            amounts = [int(amount) for amount in (chunk.amounts or '').split()]
+            if len(lines) != len(amounts):
+                raise ValueError(f"Chunk {chunk.sequence} of {self.name} has {len(lines)} rows, "
+                                 f"but {len(amounts)} amounts")
+            yield from zip(lines, amounts)
+
+    def _finalize(self) -> None:
+        """
+        Assemble stored chunks into bank payment file(s) of every paying account within file limits
+        and attach it to the job
+        """
+        self.ensure_one()
+        wizard = self.env['bank.payment']
+        metrics = ExportMetrics(self.env.cr)
+        file_format = wizard._get_file_format(self.move_ids)
+        groups = wizard._get_export_groups(self.env['account.move'].browse(self._get_ordered_move_ids()))
+        files = wizard._write_grouped_files(groups, self._iter_chunk_rows(), file_format, metrics)
+        with metrics.stage('attachment'):
+            attachment = wizard._create_bank_payment_attachment(files, file_format)
+            attachment.write({'res_model': self._name, 'res_id': self.id})
+
+        self.chunk_ids.unlink()
+        self._release_moves()
+        self.env['bank.payment.batch']._create_batch(
+            self.move_ids, attachment, self.total_lines, round(self.total_amount * 100), file_format.code)
+        self.write({'attachment_id': attachment.id, 'state': 'done'})
+        metrics.add('attachment', row_count=len(files))
+        self._add_metrics(metrics)
+        self.log_id.sudo().attachment_id = attachment
+
+    def _run(self, deadline: float) -> bool:
+        """
+        Process chunks until job is finished or deadline is reached.
+        Progress is committed after every chunk, so a killed worker resumes from last chunk.
+        return: True if job is finished
+        """
+        self.ensure_one()
+        chunk_size = self._get_chunk_size()
+        self.state = 'running'
+        self.env.cr.commit()
+
+        while self.processed_count < self.move_count:
+            if time.monotonic() > deadline:
+                return False
+            self._process_chunk(chunk_size)
+            self.env.cr.commit()
+            # records read for the chunk are not needed any more
+            self.env.invalidate_all()
+
+        if self.validation_report:
+            self.state = 'failed'
+            self._release_moves()
+        else:
+            self._finalize()
+        self.env.cr.commit()
+        return True
+
+    @api.model
+    def _cron_process_jobs(self) -> None:
+        """
+        Process pending jobs and resume running ones (e.g. after worker crash)
+        """
+        deadline = time.monotonic() + JOB_TIME_BUDGET
+        for job in self.search([('state', 'in', ('pending', 'running'))], order='id'):
+            job = job.with_user(job.create_uid).with_context(lang=job.create_uid.lang)
+            try:
+                finished = job._run(deadline)
+            except Exception as e:
+                self.env.cr.rollback()
+                _logger.exception("Bank payment job %s failed", job.id)
+                job.write({'state': 'failed', 'error': str(e)})
+                job._release_moves()
+                self.env.cr.commit()
+                continue
+
+            if not finished:
+                self.env.ref('bank_payment.ir_cron_bank_payment_job')._trigger()
+                return
+
+    ####################################################
+    # DOMAIN EXPORT
+    ####################################################
+
+    @api.model
+    def _get_export_domain(self, due_date=None, company_ids=None) -> list:
+        """
+        return domain of posted, unpaid vendor bills ready for bank payment,
+        due by due_date (default today) and not exported yet
+        """
+        domain = [
+            ('move_type', '=', 'in_invoice'),
+            ('state', '=', 'posted'),
+            ('payment_state', 'in', ('not_paid', 'partial')),
+            ('invoice_date_due', '<=', due_date or fields.Date.context_today(self)),
+            ('bank_payment_ready', '=', True),
+            ('bank_payment_batch_id', '=', False),
+            ('bank_payment_job_id', '=', False),
+        ]
+        if company_ids:
+            domain.append(('company_id', 'in', company_ids))
+        return domain
+
+    @api.model
+    def _export_by_domain(self, domain: list):
+        """
+        Create background jobs for all bills matching domain, one job per bank file format
+        (a file has one format, see bank.payment._get_file_format)
+        return: new jobs, or empty recordset if no bill matches
+        """
+        move_ids = self.env['account.move'].search(domain, order='id')
+        if not move_ids:
+            _logger.info("Bank payment export: no bills match %s", domain)
+            return self
+
+        name = f'Bank Payment {fields.Datetime.to_string(fields.Datetime.now())} (automatic)'
+        bills_by_format = self.env['bank.payment']._split_by_file_format(move_ids)
+        jobs = self.create([{
+            'name': f'{name} {code}' if len(bills_by_format) > 1 else name,
+            'move_ids': [Command.set(bills.ids)],
+            'only_new_bills': True,
+            'domain': str(domain),
+        } for code, bills in bills_by_format.items()])
+
+        empty_jobs = jobs.filtered(lambda job: not job.move_ids)
+        if empty_jobs:
+            _logger.info("Bank payment export: %s job(s) of bills matching %s have all bills exported by another run",
+                         len(empty_jobs), domain)
+            empty_jobs.unlink()
+        return jobs - empty_jobs
+
+    @api.model
+    def _cron_export_due_bills(self, due_days: int = 0, company_ids=None) -> None:
+        """
+        Scheduled export of bills due in next `due_days` days
+        """
+        due_date = fields.Date.add(fields.Date.context_today(self), days=due_days)
+        self._export_by_domain(self._get_export_domain(due_date, company_ids))
+
+    @api.model
+    def _action_export_due_bills(self):
+        """
+        return: form of new job exporting all bills due today (list if there is one job per file format),
+            or notification if there are none
+        """
+        jobs = self._export_by_domain(self._get_export_domain(company_ids=self.env.companies.ids))
+        if not jobs:
+            return {
+                'type': 'ir.actions.client',
+                'tag': 'display_notification',
+                'params': {'message': "There are no due bills ready for bank payment.", 'type': 'info'},
+            }
+
+        if len(jobs) > 1:
+            return {
+                'name': 'Bank Payment',
+                'res_model': 'bank.payment.job',
+                'domain': [('id', 'in', jobs.ids)],
+                'view_mode': 'tree,form',
+                'type': 'ir.actions.act_window',
+            }
+
+        return {
+            'name': 'Bank Payment',
+            'res_model': 'bank.payment.job',
+            'res_id': jobs.id,
+            'view_mode': 'form',
+            'type': 'ir.actions.act_window',
+        }
+
+    ####################################################
+    # ACTIONS
+    ####################################################
+
+    def action_retry(self):
+        """
+        Restart failed job. Invalid bills are checked again from the start,
+        other failures resume from the last processed chunk.
+        Bills are claimed again, bills exported by another run meanwhile are left out.
+        """
+        for job in self.filtered(lambda job: job.state == 'failed'):
+            values = {'state': 'pending', 'error': False}
+            if job.validation_report:
+                job.chunk_ids.unlink()
+                values.update(validation_report=False, processed_count=0, total_lines=0, total_amount=0)
+            job.write(values)
+            job._claim_moves()
+        self.env.ref('bank_payment.ir_cron_bank_payment_job')._trigger()
+
+    def action_download(self):
+        """
+        return: download generated bank payment file
+        """
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_url',
+            'name': 'Bank Payment',
+            'url': f'/web/content/{self.attachment_id.id}?download=true'
+        }
+
+
+class BankPaymentJobChunk(models.Model):
+    _name = 'bank.payment.job.chunk'
+    _description = 'Rendered rows of one chunk of bank payment job'
+    _order = 'sequence'
+
+    job_id = fields.Many2one('bank.payment.job', required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer(required=True)
+    data = fields.Text(help="Rendered rows as JSON list (rows may contain line breaks)")
+    amounts = fields.Text(help="Amount (in cents) of every row, space separated")
@@ -0,0 +1,82 @@
+import json
+import logging
+
+from odoo import models, fields, api, Command
+
+_logger = logging.getLogger(__name__)
+
+
+class BankPaymentLog(models.Model):
+    _name = 'bank.payment.log'
+    _description = 'Bank payment export run with duration of its stages'
+    _order = 'id desc'
+
+    name = fields.Char(required=True, readonly=True)
+    move_count = fields.Integer(readonly=True)
+    skipped_count = fields.Integer(
+        readonly=True, help="Selected bills left out, because another run was exporting them or exported them meanwhile")
+    attachment_id = fields.Many2one('ir.attachment', readonly=True, ondelete='set null')
+    stage_ids = fields.One2many('bank.payment.log.stage', 'log_id', readonly=True)
+    duration = fields.Float(compute='_compute_totals', store=True, digits=(16, 3), help="Seconds")
+    query_count = fields.Integer(compute='_compute_totals', store=True)
+
+    @api.depends('stage_ids.duration', 'stage_ids.query_count')
+    def _compute_totals(self):
+        for log in self:
+            log.duration = sum(log.stage_ids.mapped('duration'))
+            log.query_count = sum(log.stage_ids.mapped('query_count'))
+
+    def _add_metrics(self, metrics) -> None:
+        """
+        Add stages measured by ExportMetrics (summed with stages already on the log)
+        and write them to server log
+        """
+        self.ensure_one()
+        stages = {stage.name: stage for stage in self.stage_ids}
+        commands = []
+        for name, values in metrics.stages.items():
+            if name in stages:
+                stage = stages[name]
+                commands.append(Command.update(stage.id, {
+                    'duration': stage.duration + values['duration'],
+                    'query_count': stage.query_count + values['query_count'],
+                    'row_count': stage.row_count + values['row_count'],
+                }))
+            else:
+                commands.append(Command.create(dict(values, name=name, sequence=len(stages) + len(commands))))
+        self.stage_ids = commands
+
+        _logger.info("bank payment export %s", json.dumps({
+            'log_id': self.id,
+            'name': self.name,
+            'move_count': self.move_count,
+            'skipped_count': self.skipped_count,
+            'stages': metrics.stages,
+        }))
+
+    @api.model
+    def _log_export(self, name: str, move_count: int, metrics, attachment=None, skipped_count: int = 0):
+        """
+        return: new export log with stages measured by ExportMetrics
+        """
+        log = self.sudo().create({
+            'name': name,
+            'move_count': move_count,
+            'skipped_count': skipped_count,
+            'attachment_id': attachment.id if attachment else False,
+        })
+        log._add_metrics(metrics)
+        return log
+
+
+class BankPaymentLogStage(models.Model):
+    _name = 'bank.payment.log.stage'
+    _description = 'Stage of bank payment export run'
+    _order = 'log_id, sequence'
+
+    log_id = fields.Many2one('bank.payment.log', required=True, ondelete='cascade', index=True)
+    sequence = fields.Integer()
+    name = fields.Char(required=True)
+    duration = fields.Float(digits=(16, 3), help="Seconds")
+    query_count = fields.Integer()
+    row_count = fields.Integer()
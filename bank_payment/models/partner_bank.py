@@ -1,4 +1,9 @@
 from odoo import models, fields, api
+from odoo.addons.bank_payment.lib.formats import DEFAULT_FORMAT, FORMATS
+
+# fields of company bank accounts bank payment readiness depends on
+# (first account of the company by sequence pays the bills)
+READY_FIELDS = {'partner_id', 'acc_number', 'bank_file_format', 'sequence', 'active'}
 
 
 class ResPartnerBank(models.Model):
@@ -20,3 +25,40 @@ class ResPartnerBank(models.Model):
     ], help="Choose option for card code.\n"
         "Selected option will be used during export data for bank payment in case it's payment card .\n"
         "If nothing is selected, error will be raised")
+    bank_file_format = fields.Selection(
+        selection='_get_bank_file_formats', default=DEFAULT_FORMAT,
+        help="Format of bank payment file for bills paid from this account "
+             "(bills are paid from the first bank account of their company)")
+
+    @api.model
+    def _get_bank_file_formats(self) -> list:
+        return [(code, file_format.name) for code, file_format in FORMATS.items()]
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        accounts = super().create(vals_list)
+        self._outdate_company_bank_payment_ready(accounts.partner_id)
+        return accounts
+
+    def write(self, vals):
+        if not READY_FIELDS.intersection(vals):
+            return super().write(vals)
+
+        partners = self.partner_id
+        res = super().write(vals)
+        self._outdate_company_bank_payment_ready(partners | self.partner_id)
+        return res
+
+    def unlink(self):
+        partners = self.partner_id
+        res = super().unlink()
+        self._outdate_company_bank_payment_ready(partners)
+        return res
+
+    @api.model
+    def _outdate_company_bank_payment_ready(self, partners: models.Model) -> None:
+        """
+        Mark bills of companies of the partners for recompute of bank payment readiness
+        """
+        companies = self.env['res.company'].sudo().search([('partner_id', 'in', partners.ids)])
+        self.env['account.move']._outdate_bank_payment_ready(companies.ids)
@@ -0,0 +1,3 @@
+from . import test_bank_file
+from . import test_bank_payment_batch
+from . import test_pain001
@@ -0,0 +1,359 @@
+import io
+import json
+import os
+import tempfile
+from contextlib import redirect_stderr
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.bank_payment.lib.bank_file import (
+    DOMESTIC, FIRST_LINE, INTERNATIONAL, LAST_LINE, MAX_FILE_AMOUNT, PAYMENT_CARD,
+    BankFileSplitter, CharsetTable, FileFooter, FileHeader, Payment,
+    check_bank_file, main, parse_line, write_bank_file,
+)
+
+CREATION_DATE = '20240131'
+
+# field lengths of the original exporter (before layouts were compiled)
+BASELINE_RULES = {
+    'total_lines': (6, 'int'), 'total_amount': (13, 'int'), 'trans_type': (14, 'txt'), 'index': (4, 'int'),
+    'eksp_date': (8, 'int'), 'amount': (13, 'int'), 'currency': (3, 'txt'), 'from_type': (1, 'int'),
+    'from_account': (15, 'int'), 'transaction_type': (1, 'int'), 'cust_reg': (4, 'int'), 'cust_acc': (10, 'int'),
+    'recipient_acc_number': (34, 'txt'), 'swift_number': (11, 'txt'), 'journal_text': (35, 'txt'),
+    'transfer_type': (2, 'int'), 'name': (32, 'txt'), 'recipient': (35, 'txt'), 'street': (32, 'txt'),
+    'street2': (32, 'txt'), 'zip_code': (4, 'txt'), 'city': (32, 'txt'), 'recipient_street': (35, 'txt'),
+    'recipient_street2': (35, 'txt'), 'recipient_country': (35, 'txt'), 'notification_text': (35, 'txt'),
+    'document_reference': (35, 'txt'), 'payment_id': (19, 'txt'), 'card_code': (2, 'txt'),
+}
+
+
+def baseline_value(rule: str, value: str, plus_sign: bool = False) -> str:
+    """
+    value formatted the way the original exporter did it (blankN rules are N spaces)
+    """
+    length, rule_type = BASELINE_RULES[rule] if rule in BASELINE_RULES else (int(rule[5:]), 'txt')
+    if len(value) < length:
+        if rule_type == 'txt':
+            return f'"{value + " " * (length - len(value))}"'
+        value = '0' * (length - len(value)) + value
+        return f'"{value}+"' if plus_sign else f'"{value}"'
+    return f'"{value[:length]}"'
+
+
+def make_payment(**values) -> Payment:
+    vals = {
+        'eksp_date': '20240215',
+        'amount': 123456,
+        'currency': 'DKK',
+        'from_type': '2',
+        'from_account': '123456789012345',
+        'cust_reg': '1234',
+        'cust_acc': '5678901234',
+        'journal_text': 'Invoice 42',
+        'recipient_acc_number': 'DK5000400440116243',
+        'swift_number': 'DABADKKK',
+        'name': 'Supplier With A Rather Long Name That Is Cut',
+        'street': 'Main Street 1',
+        'street2': '',
+        'zip_code': '2100',
+        'city': 'Copenhagen',
+        'country': 'Denmark',
+        'own_journal_number': 'BILL/2024/0001',
+        'notification_text1': 'First paragraph',
+        'notification_text2': 'Second paragraph',
+        'document_reference': 'REF-42',
+        'card_code': '71',
+    }
+    vals.update(values)
+    return Payment(**vals)
+
+
+@tagged('post_install', '-at_install')
+class TestLayouts(BaseCase):
+
+    def test_domestic(self):
+        payment = make_payment(trans_type=DOMESTIC.code)
+        expected = ','.join([
+            baseline_value('trans_type', DOMESTIC.code),
+            baseline_value('index', '0001'),
+            baseline_value('eksp_date', payment.eksp_date),
+            baseline_value('amount', str(payment.amount), True),
+            baseline_value('currency', payment.currency),
+            baseline_value('from_type', payment.from_type),
+            baseline_value('from_account', payment.from_account),
+            baseline_value('transaction_type', '2'),
+            baseline_value('cust_reg', payment.cust_reg),
+            baseline_value('cust_acc', payment.cust_acc),
+            baseline_value('from_type', payment.transaction_option),
+            baseline_value('journal_text', payment.journal_text),
+            baseline_value('name', payment.name),
+            baseline_value('street', payment.street),
+            baseline_value('street2', payment.street2),
+            baseline_value('zip_code', payment.zip_code),
+            baseline_value('city', payment.city),
+            payment.own_journal_number,
+            baseline_value('notification_text', payment.notification_text1),
+            baseline_value('notification_text', payment.notification_text2),
+            baseline_value('notification_text', ''),
+            baseline_value('notification_text', ''),
+            baseline_value('notification_text', ''),
+            baseline_value('blank35', ''),
+            baseline_value('document_reference', payment.document_reference),
+            *[baseline_value('blank35', '')] * 3,
+            baseline_value('blank3', ''),
+            *[baseline_value('blank35', '')] * 4,
+            baseline_value('blank6', ''),
+            baseline_value('blank14', ''),
+        ])
+        self.assertEqual(DOMESTIC.render(payment), expected)
+
+    def test_international(self):
+        payment = make_payment(trans_type=INTERNATIONAL.code)
+        expected = ','.join([
+            baseline_value('trans_type', INTERNATIONAL.code),
+            baseline_value('index', '0001'),
+            baseline_value('eksp_date', payment.eksp_date),
+            baseline_value('amount', str(payment.amount), True),
+            baseline_value('from_type', payment.from_type),
+            baseline_value('from_account', payment.from_account),
+            baseline_value('currency', payment.currency),
+            baseline_value('currency', payment.currency),
+            baseline_value('transfer_type', payment.transfer_type),
+            baseline_value('document_reference', payment.document_reference),
+            *[baseline_value('blank35', '')] * 3,
+            baseline_value('recipient', payment.name),
+            baseline_value('recipient_street', payment.street),
+            baseline_value('recipient_street2', payment.street2),
+            baseline_value('recipient_country', payment.country),
+            baseline_value('recipient_acc_number', payment.recipient_acc_number),
+            baseline_value('swift_number', payment.swift_number),
+            baseline_value('blank45', ''),
+            baseline_value('blank75', ''),
+            baseline_value('blank75', ''),
+            baseline_value('blank24', ''),
+            baseline_value('blank215', ''),
+        ])
+        self.assertEqual(INTERNATIONAL.render(payment), expected)
+
+    def test_payment_card(self):
+        payment = make_payment(trans_type=PAYMENT_CARD.code)
+        expected = ','.join([
+            baseline_value('trans_type', PAYMENT_CARD.code),
+            baseline_value('index', '0001'),
+            baseline_value('eksp_date', payment.eksp_date),
+            baseline_value('amount', str(payment.amount), True),
+            baseline_value('from_type', payment.from_type),
+            baseline_value('from_account', payment.from_account),
+            baseline_value('card_code', payment.card_code),
+            baseline_value('payment_id', payment.journal_text),
+            baseline_value('blank4', ''),
+            baseline_value('blank10', ''),
+            baseline_value('blank8', ''),
+            baseline_value('name', payment.name),
+            baseline_value('blank32', ''),
+            baseline_value('document_reference', payment.document_reference),
+            *[baseline_value('blank35', '')] * 11,
+            baseline_value('blank16', ''),
+            baseline_value('blank215', ''),
+        ])
+        self.assertEqual(PAYMENT_CARD.render(payment), expected)
+
+    def test_first_and_last_line(self):
+        self.assertEqual(FIRST_LINE.render(FileHeader(CREATION_DATE)), ','.join([
+            baseline_value('trans_type', FIRST_LINE.code),
+            baseline_value('eksp_date', CREATION_DATE),
+            baseline_value('blank90', ''),
+            *[baseline_value('blank255', '')] * 3,
+        ]))
+        self.assertEqual(LAST_LINE.render(FileFooter(CREATION_DATE, 3, 4200)), ','.join([
+            baseline_value('trans_type', LAST_LINE.code),
+            baseline_value('eksp_date', CREATION_DATE),
+            baseline_value('total_lines', '3'),
+            baseline_value('total_amount', '4200', True),
+            baseline_value('blank64', ''),
+            *[baseline_value('blank255', '')] * 3,
+        ]))
+
+    def test_int_value_of_full_length_has_no_plus_sign(self):
+        line = LAST_LINE.render(FileFooter(CREATION_DATE, 1, MAX_FILE_AMOUNT))
+        self.assertIn(f'"{MAX_FILE_AMOUNT}"', line)
+
+
+@tagged('post_install', '-at_install')
+class TestCharsetTable(BaseCase):
+
+    def test_latin1(self):
+        table = CharsetTable('iso-8859-1')
+        self.assertEqual(table.encode('Æble ø å'), 'Æble ø å'.encode('iso-8859-1'))
+        self.assertEqual(table.encode('€ – “x”'), b"E - 'x'")
+        self.assertEqual(table.encode('Łódź'), b'L\xf3dz')
+        self.assertEqual(table.encode('中'), b'?')
+
+    def test_control_characters_become_spaces(self):
+        self.assertEqual(CharsetTable('iso-8859-1').encode('a\nb\tc\r'), b'a b c ')
+
+    def test_ascii(self):
+        self.assertEqual(CharsetTable('ascii').encode('Æbleø é'), b'Ableo e')
+
+    def test_encoded_line_is_translated_line(self):
+        texts = ['Søren Ærø', 'plain ascii', 'a\u00a0b', 'Łódź', '€ 5', '中文', 'tab\there', 'é']
+        for charset in ('iso-8859-1', 'ascii', 'utf-8', 'cp1252'):
+            table = CharsetTable(charset)
+            for text in texts:
+                self.assertEqual(table.encode(text), text.translate(table).encode(charset), (charset, text))
+
+    def test_width_is_kept(self):
+        table = CharsetTable('ascii')
+        text = 'Søren Ærø — “Café” € 中文\n'
+        self.assertEqual(len(table.encode(text)), len(text))
+
+
+@tagged('post_install', '-at_install')
+class TestBankFileSplitter(BaseCase):
+
+    def split(self, rows, **kwargs):
+        splitter = BankFileSplitter(
+            io.BytesIO,
+            lambda total_lines, total_amount: f'H{total_lines}:{total_amount}',
+            lambda total_lines, total_amount: f'F{total_lines}:{total_amount}',
+            **kwargs)
+        for line, amount in rows:
+            splitter.write(line, amount)
+        return [(stream.getvalue(), total_lines, total_amount)
+                for stream, total_lines, total_amount in splitter.close()]
+
+    def test_one_file(self):
+        self.assertEqual(self.split([('a', 1), ('b', 2)]), [(b'H0:0\na\nb\nF2:3', 2, 3)])
+
+    def test_no_rows(self):
+        self.assertEqual(self.split([]), [(b'H0:0\nF0:0', 0, 0)])
+
+    def test_max_lines(self):
+        files = self.split([(str(i), 1) for i in range(5)], max_lines=2)
+        self.assertEqual(files, [
+            (b'H0:0\n0\n1\nF2:2', 2, 2),
+            (b'H0:0\n2\n3\nF2:2', 2, 2),
+            (b'H0:0\n4\nF1:1', 1, 1),
+        ])
+
+    def test_max_amount(self):
+        files = self.split([('a', 60), ('b', 40), ('c', 150), ('d', 1)], max_amount=100)
+        self.assertEqual([(total_lines, total_amount) for content, total_lines, total_amount in files],
+                         [(2, 100), (1, 150), (1, 1)])
+
+    def test_header_needs_totals(self):
+        files = self.split([('a', 5), ('b', 7), ('c', 1)], max_lines=2, header_needs_totals=True)
+        self.assertEqual([content for content, total_lines, total_amount in files],
+                         [b'H2:12\na\nb\nF2:12', b'H1:1\nc\nF1:1'])
+
+
+@tagged('post_install', '-at_install')
+class TestReader(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, payments) -> str:
+        path = os.path.join(self.directory, 'bank_payment.txt')
+        with open(path, 'wb') as stream:
+            write_bank_file(payments, stream, CREATION_DATE)
+        return path
+
+    def test_round_trip(self):
+        payments = [
+            make_payment(trans_type=DOMESTIC.code, amount=100),
+            make_payment(trans_type=INTERNATIONAL.code, amount=2000),
+            make_payment(trans_type=PAYMENT_CARD.code, amount=30000),
+        ]
+        parsed = []
+        result = check_bank_file(self.write(payments), parsed.append)
+
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['header'].creation_date, CREATION_DATE)
+        self.assertEqual((result['footer'].total_lines, result['footer'].total_amount), (3, 32100))
+        self.assertEqual([payment.trans_type for payment in parsed], [payment.trans_type for payment in payments])
+        self.assertEqual([payment.amount for payment in parsed], [100, 2000, 30000])
+        self.assertEqual(parsed[0].own_journal_number, 'BILL/2024/0001')
+        self.assertEqual(parsed[0].name, payments[0].name[:32])
+        self.assertEqual([payment.document_reference for payment in parsed], ['REF-42'] * 3)
+
+    def test_comma_in_own_journal_number(self):
+        payment = make_payment(own_journal_number='BILL,2024,0001', name='Supplier, Inc.')
+        parsed = parse_line(DOMESTIC.render(payment))
+        self.assertEqual(parsed.own_journal_number, 'BILL,2024,0001')
+        self.assertEqual(parsed.name, 'Supplier, Inc.')
+        self.assertEqual(parsed.notification_text1, 'First paragraph')
+
+    def test_wrong_field_count(self):
+        with self.assertRaises(ValueError):
+            parse_line(INTERNATIONAL.render(make_payment()) + ',"x"')
+        with self.assertRaises(ValueError):
+            parse_line('"IB123"')
+
+    def test_wrong_totals(self):
+        path = os.path.join(self.directory, 'bank_payment.txt')
+        with open(path, 'w', encoding='iso-8859-1') as bank_file:
+            bank_file.write('\n'.join([
+                FIRST_LINE.render(FileHeader(CREATION_DATE)),
+                DOMESTIC.render(make_payment(amount=100)),
+                LAST_LINE.render(FileFooter(CREATION_DATE, 2, 150)),
+            ]))
+        self.assertEqual(check_bank_file(path)['errors'], [
+            "Footer total_lines 2 != 1 payment rows",
+            "Footer total_amount 150 != 100 sum of payment rows",
+        ])
+
+    def test_missing_header_and_footer(self):
+        path = os.path.join(self.directory, 'bank_payment.txt')
+        with open(path, 'w', encoding='iso-8859-1') as bank_file:
+            bank_file.write(DOMESTIC.render(make_payment()))
+        self.assertEqual(check_bank_file(path)['errors'], ["Header is missing", "Footer is missing"])
+
+
+@tagged('post_install', '-at_install')
+class TestCommandLine(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def run_main(self, argv) -> str:
+        stderr = io.StringIO()
+        with redirect_stderr(stderr):
+            self.assertEqual(main(argv), 0)
+        return stderr.getvalue()
+
+    def test_json(self):
+        source = os.path.join(self.directory, 'payments.json')
+        output = os.path.join(self.directory, 'bank_payment.txt')
+        with open(source, 'w', encoding='utf-8') as payments_file:
+            json.dump([
+                {'trans_type': DOMESTIC.code, 'amount': 1500, 'name': 'Søren', 'own_journal_number': 'BILL/1'},
+                {'trans_type': PAYMENT_CARD.code, 'amount': '2500', 'card_code': 71, 'unknown': 'ignored'},
+            ], payments_file)
+
+        self.assertEqual(self.run_main([source, '-o', output, '--date', CREATION_DATE]),
+                         "2 payments, total amount 4000\n")
+        parsed = []
+        result = check_bank_file(output, parsed.append)
+        self.assertEqual(result['errors'], [])
+        self.assertEqual(result['header'].creation_date, CREATION_DATE)
+        self.assertEqual(parsed[0].name, 'Søren')
+        self.assertEqual(parsed[1].card_code, '71')
+
+    def test_csv(self):
+        source = os.path.join(self.directory, 'payments.csv')
+        output = os.path.join(self.directory, 'bank_payment.txt')
+        with open(source, 'w', encoding='utf-8', newline='') as payments_file:
+            payments_file.write('trans_type,amount,name\n')
+            payments_file.write(f'{INTERNATIONAL.code},700,"Supplier, Inc."\n')
+
+        self.assertEqual(self.run_main([source, '-o', output, '--date', CREATION_DATE, '--charset', 'ascii']),
+                         "1 payments, total amount 700\n")
+        result = check_bank_file(output, charset='ascii')
+        self.assertEqual((result['errors'], result['total_lines'], result['total_amount']), ([], 1, 700))
@@ -0,0 +1,35 @@
+import hashlib
+
+from odoo.tests.common import TransactionCase, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestBankPaymentBatch(TransactionCase):
+
+    def test_large_total_amount(self):
+        # above int4 range in cents (21,474,836.47)
+        total_amount = 5_000_000_000_00
+        attachment = self.env['ir.attachment'].create({'name': 'bank_payment.txt', 'raw': b''})
+        batch = self.env['bank.payment.batch']._create_batch(
+            self.env['account.move'], attachment, 100000, total_amount)
+        batch.flush_recordset()
+        batch.invalidate_recordset()
+        self.assertEqual(batch.total_amount, 5_000_000_000.0)
+        self.assertEqual(batch.attachment_id, attachment)
+
+    def test_gc_expires_batch_file(self):
+        attachment = self.env['ir.attachment'].create({'name': 'bank_payment.txt', 'raw': b'row\r\n'})
+        batch = self.env['bank.payment.batch']._create_batch(self.env['account.move'], attachment, 1, 100)
+        recent = self.env['ir.attachment'].create({'name': 'bank_payment.txt', 'raw': b'recent\r\n'})
+        recent_batch = self.env['bank.payment.batch']._create_batch(self.env['account.move'], recent, 1, 100)
+        self.env.flush_all()
+        self.env.cr.execute(
+            "UPDATE ir_attachment SET create_date = now() - interval '1 year' WHERE id = %s", [attachment.id])
+        self.env.invalidate_all()
+
+        self.env['bank.payment.batch']._gc_export_attachments()
+        self.assertFalse(attachment.exists())
+        self.assertTrue(batch.exists())
+        self.assertFalse(batch.attachment_id)
+        self.assertEqual(batch.checksum, hashlib.sha1(b'row\r\n').hexdigest())
+        self.assertEqual(recent_batch.attachment_id, recent)
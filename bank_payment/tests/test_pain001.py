@@ -0,0 +1,145 @@
+import io
+import os
+import tempfile
+from xml.etree import ElementTree
+
+from odoo.tests.common import BaseCase, tagged
+
+from odoo.addons.bank_payment.lib.bank_file import BankFileSplitter, FileFooter, FileHeader, Payment
+from odoo.addons.bank_payment.lib.formats import get_format
+from odoo.addons.bank_payment.lib.pain001 import NAMESPACE
+
+HEADER = FileHeader(creation_date='20240131', created_at='2024-01-31T10:00:00', initiating_party='My Company')
+
+
+def make_payment(**values) -> Payment:
+    vals = {
+        'trans_type': 'domestic',
+        'eksp_date': '20240215',
+        'amount': 12345,
+        'currency': 'EUR',
+        'from_account': 'DK50 0040 0440 1162 43',
+        'debtor_name': 'My Company',
+        'debtor_bic': 'DABADKKK',
+        'journal_text': 'Invoice 42',
+        'recipient_acc_number': 'DE89370400440532013000',
+        'swift_number': 'COBADEFFXXX',
+        'name': 'Supplier GmbH',
+        'street': 'Hauptstraße 1',
+        'zip_code': '10115',
+        'city': 'Berlin',
+        'country_code': 'DE',
+        'own_journal_number': 'BILL/2024/0001',
+    }
+    vals.update(values)
+    return Payment(**vals)
+
+
+def children(element) -> list:
+    return [child.tag.replace(f'{{{NAMESPACE}}}', '') for child in element]
+
+
+@tagged('post_install', '-at_install')
+class TestPain001(BaseCase):
+
+    def setUp(self):
+        super().setUp()
+        self.format = get_format('pain001')
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def write(self, payments, header_needs_totals: bool = True) -> bytes:
+        """
+        return file written the way exports write it (rows spooled, header written with totals)
+        """
+        splitter = BankFileSplitter(
+            io.BytesIO,
+            lambda total_lines, total_amount: self.format.first_line(
+                HEADER, FileFooter(HEADER.creation_date, total_lines, total_amount)),
+            lambda total_lines, total_amount: self.format.last_line(
+                HEADER, FileFooter(HEADER.creation_date, total_lines, total_amount)),
+            charset=self.format.charset, header_needs_totals=header_needs_totals)
+        for payment in payments:
+            splitter.write(self.format.render_payment(payment), payment.amount)
+        [(stream, _total_lines, _total_amount)] = splitter.close()
+        return stream.getvalue()
+
+    def write_file(self, content: bytes) -> str:
+        path = os.path.join(self.directory, 'bank_payment.xml')
+        with open(path, 'wb') as bank_file:
+            bank_file.write(content)
+        return path
+
+    def find(self, element, path: str):
+        return element.find('/'.join(f'{{{NAMESPACE}}}{name}' for name in path.split('/')))
+
+    def test_element_order(self):
+        document = ElementTree.fromstring(self.write([make_payment()]))
+        self.assertEqual(children(document), ['CstmrCdtTrfInitn'])
+        initiation = self.find(document, 'CstmrCdtTrfInitn')
+        self.assertEqual(children(initiation), ['GrpHdr', 'PmtInf'])
+        self.assertEqual(children(self.find(initiation, 'GrpHdr')),
+                         ['MsgId', 'CreDtTm', 'NbOfTxs', 'CtrlSum', 'InitgPty'])
+        payment_info = self.find(initiation, 'PmtInf')
+        self.assertEqual(children(payment_info), [
+            'PmtInfId', 'PmtMtd', 'NbOfTxs', 'CtrlSum', 'ReqdExctnDt',
+            'Dbtr', 'DbtrAcct', 'DbtrAgt', 'ChrgBr', 'CdtTrfTxInf',
+        ])
+        self.assertEqual(children(self.find(payment_info, 'CdtTrfTxInf')),
+                         ['PmtId', 'Amt', 'CdtrAgt', 'Cdtr', 'CdtrAcct', 'RmtInf'])
+
+    def test_totals(self):
+        payments = [make_payment(amount=12345), make_payment(amount=5), make_payment(amount=100000)]
+        initiation = self.find(ElementTree.fromstring(self.write(payments)), 'CstmrCdtTrfInitn')
+        self.assertEqual(self.find(initiation, 'GrpHdr/NbOfTxs').text, '3')
+        self.assertEqual(self.find(initiation, 'GrpHdr/CtrlSum').text, '1123.50')
+        for payment_info, amount in zip(initiation.findall(f'{{{NAMESPACE}}}PmtInf'), ['123.45', '0.05', '1000.00']):
+            self.assertEqual(self.find(payment_info, 'NbOfTxs').text, '1')
+            self.assertEqual(self.find(payment_info, 'CtrlSum').text, amount)
+            self.assertEqual(self.find(payment_info, 'CdtTrfTxInf/Amt/InstdAmt').text, amount)
+
+    def test_escaping(self):
+        payment = make_payment(name='Smith & Sons <Ltd> "A"', journal_text="Ref <1> & 'x'",
+                               own_journal_number='BILL&1', currency='E"R')
+        payment_info = self.find(ElementTree.fromstring(self.write([payment])), 'CstmrCdtTrfInitn/PmtInf')
+        self.assertEqual(self.find(payment_info, 'CdtTrfTxInf/Cdtr/Nm').text, 'Smith & Sons <Ltd> "A"')
+        self.assertEqual(self.find(payment_info, 'CdtTrfTxInf/RmtInf/Ustrd').text, "Ref <1> & 'x'")
+        self.assertEqual(self.find(payment_info, 'PmtInfId').text, 'BILL&1')
+        self.assertEqual(self.find(payment_info, 'CdtTrfTxInf/Amt/InstdAmt').get('Ccy'), 'E"R')
+
+    def test_account_identification(self):
+        payment = make_payment(recipient_acc_number='12345678901234')
+        payment_info = self.find(ElementTree.fromstring(self.write([payment])), 'CstmrCdtTrfInitn/PmtInf')
+        self.assertEqual(self.find(payment_info, 'DbtrAcct/Id/IBAN').text, 'DK5000400440116243')
+        self.assertEqual(self.find(payment_info, 'CdtTrfTxInf/CdtrAcct/Id/Othr/Id').text, '12345678901234')
+
+    def test_round_trip(self):
+        path = self.write_file(self.write([
+            make_payment(amount=12345, name='Søren & Co'),
+            make_payment(amount=99, own_journal_number='BILL/2024/0002', journal_text='Invoice 43'),
+        ]))
+        parsed = []
+        result = self.format.check_file(path, parsed.append)
+        self.assertEqual(result['errors'], [])
+        self.assertEqual((result['total_lines'], result['total_amount']), (2, 12444))
+        self.assertEqual(result['header'].initiating_party, 'My Company')
+        # characters written with more than one byte are transliterated (see CharsetTable)
+        self.assertEqual([(payment.own_journal_number, payment.amount, payment.name, payment.journal_text)
+                          for payment in parsed], [
+            ('BILL/2024/0001', 12345, 'Soren & Co', 'Invoice 42'),
+            ('BILL/2024/0002', 99, 'Supplier GmbH', 'Invoice 43'),
+        ])
+        self.assertEqual((parsed[0].eksp_date, parsed[0].currency), ('20240215', 'EUR'))
+
+    def test_wrong_totals(self):
+        # header written before the rows gets zero totals
+        path = self.write_file(self.write([make_payment(amount=100)], header_needs_totals=False))
+        self.assertEqual(self.format.check_file(path)['errors'], [
+            "Group header NbOfTxs 0 != 1 payments",
+            "Group header CtrlSum 0 != 100 sum of payments",
+        ])
+
+    def test_invalid_xml(self):
+        path = self.write_file(self.write([make_payment()])[:-20])
+        self.assertTrue(self.format.check_file(path)['errors'][0].startswith("File is not valid XML"))
@@ -1,541 +1,1110 @@
-from odoo import models, fields, api
+from odoo import models, fields, api, Command, sql_db
 from odoo.exceptions import UserError
-from odoo.tools.misc import format_date
-from odoo.tools import html2plaintext
-from collections import OrderedDict
-import base64
+from odoo.modules.registry import Registry
+from odoo.tools import config
+from odoo.tools.misc import format_date, split_every
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import zipfile
 
+from odoo.addons.bank_payment.lib.bank_file import (
+    DEFAULT_CHARSET, MAX_FILE_AMOUNT, SPOOL_MAX_SIZE,
+    BankFileSplitter, ExportCache, FileFooter, FileHeader, Payment,
+)
+from odoo.addons.bank_payment.lib.export import (
+    EXPORT_ATTACHMENT_MODELS, SHARD_SIZE, STREAM_CHUNK_SIZE, ExportMetrics, StreamBuffer,
+)
+from odoo.addons.bank_payment.lib.formats import DEFAULT_FORMAT, BankFileFormat, get_format
+from odoo.addons.bank_payment.exceptions import BankPaymentDataError
 
-class BankPayment(models.TransientModel):
-    _name = 'bank.payment'
-    _description = 'Get txt file ready for import to bank'
 
-    def error_handler(self, move_name: str, field_name: str) -> None:
-        raise UserError(f"""
-        Insufficient data!!
-        Invoice number: {move_name}
-        Missing field: {field_name}
-        """)
+# bills prefetched and rendered at once, ORM cache is dropped after each chunk
+EXPORT_CHUNK_SIZE = 1000
 
-    ####################################################
-    # RULES
-    ####################################################
+# part of fingerprint of cached rows, change it when rendering of rows changes
+ROW_CACHE_VERSION = 1
 
-    def _get_value_rule(self, value: str, field_value: str, plus_sign: bool = False) -> str:
-        """
-        Based on rules return string that matches those rules
-        Example:
-        param:
-            value='name'
-            field_value='test'
-            rules = {
-                'name': {
-                    'len': 8,
-                    'type': 'txt'
-                },
-            }
-        return: "test    "  # notice spaces and quotations
-        """
-        rules = {
-            'total_lines': {'len': 6, 'type': 'int'},
-            'total_amount': {'len': 13, 'type': 'int'},
-            'trans_type': {'len': 14, 'type': 'txt'},
-            'index': {'len': 4, 'type': 'int'},
-            'eksp_date': {'len': 8, 'type': 'int'},
-            'amount': {'len': 13, 'type': 'int'},
-            'currency': {'len': 3, 'type': 'txt'},
-            'from_type': {'len': 1, 'type': 'int'},
-            'from_account': {'len': 15, 'type': 'int'},
-            'transaction_type': {'len': 1, 'type': 'int'},
-            'cust_reg': {'len': 4, 'type': 'int'},
-            'cust_acc': {'len': 10, 'type': 'int'},
-            'recipient_acc_number': {'len': 34, 'type': 'txt'},
-            'swift_number': {'len': 11, 'type': 'txt'},
-            'transaction_option': {'len': 1, 'type': 'int'},
-            'journal_text': {'len': 35, 'type': 'txt'},
-            'transfer_type': {'len': 2, 'type': 'int'},
-            'name': {'len': 32, 'type': 'txt'},
-            'recipient': {'len': 35, 'type': 'txt'},
-            'street': {'len': 32, 'type': 'txt'},
-            'street2': {'len': 32, 'type': 'txt'},
-            'zip_code': {'len': 4, 'type': 'txt'},
-            'city': {'len': 32, 'type': 'txt'},
-            'recipient_street': {'len': 35, 'type': 'txt'},
-            'recipient_street2': {'len': 35, 'type': 'txt'},
-            'recipient_country': {'len': 35, 'type': 'txt'},
-            'journal_name': {'len': 35, 'type': 'txt'},
-            'notification_text': {'len': 35, 'type': 'txt'},
-            'document_reference': {'len': 35, 'type': 'txt'},
-            'payment_id': {'len': 19, 'type': 'txt'},
-            'card_code': {'len': 2, 'type': 'txt'},
-            'blank2': {'len': 2, 'type': 'txt'},
-            'blank3': {'len': 3, 'type': 'txt'},
-            'blank4': {'len': 4, 'type': 'txt'},
-            'blank6': {'len': 6, 'type': 'txt'},
-            'blank8': {'len': 8, 'type': 'txt'},
-            'blank10': {'len': 10, 'type': 'txt'},
-            'blank14': {'len': 14, 'type': 'txt'},
-            'blank16': {'len': 16, 'type': 'txt'},
-            'blank24': {'len': 24, 'type': 'txt'},
-            'blank32': {'len': 32, 'type': 'txt'},
-            'blank35': {'len': 35, 'type': 'txt'},
-            'blank45': {'len': 45, 'type': 'txt'},
-            'blank64': {'len': 64, 'type': 'txt'},
-            'blank75': {'len': 75, 'type': 'txt'},
-            'blank90': {'len': 90, 'type': 'txt'},
-            'blank215': {'len': 215, 'type': 'txt'},
-            'blank255': {'len': 255, 'type': 'txt'},
-        }
-        rule = rules[value]
-        if len(field_value) < rule['len']:
-            if rule['type'] == 'txt':
-                field_value += ' ' * (rule['len'] - len(field_value))
-                final_value = f'\"{field_value}\"'
-
-            elif rule['type'] == 'int':
-                field_value = '0' * (rule['len'] - len(field_value)) + field_value
-                if plus_sign:
-                    final_value = f'\"{field_value}+\"'
-                else:
-                    final_value = f'\"{field_value}\"'
+####################################################
+# PARALLEL WORKERS
+####################################################
 
-        elif len(field_value) == rule['len']:
-            final_value = f'\"{field_value}\"'
+_parent_db_pool = None
+_worker_db = None
+
+
+def _init_shard_worker(db_name: str) -> None:
+    """
+    Forked worker must not use database connections of parent process: inherited registry
+    (and its Connection) still holds parent pool, whose idle connections share sockets with the parent.
+    Parent pool is kept referenced and never closed (closing would end sessions of the parent,
+    worker exits without running finalizers), worker connects through a new pool of its own.
+    """
+    global _parent_db_pool, _worker_db
+    _parent_db_pool = sql_db._Pool
+    sql_db._Pool = None
+    _worker_db = sql_db.db_connect(db_name)
 
-        else:
-            field_value = field_value[0:rule['len']]  # Cut the value if length is more than requested
-            final_value = f'\"{field_value}\"'
 
-        return final_value
+def _render_shard(uid: int, context: dict, move_ids: list) -> tuple:
+    """
+    Validate and render one shard of bills with own connection (see _init_shard_worker)
+    return: (rendered rows, their amounts, validation report, newly rendered rows to store)
+    """
+    with _worker_db.cursor() as cr:
+        env = api.Environment(cr, uid, context)
+        # rows are stored by parent process, which holds locks of the bills
+        return env['bank.payment']._render_bill_chunk(move_ids, ExportMetrics(cr), store=False)
+
+
+def _stream_bank_payment(db_name: str, uid: int, context: dict, move_ids: list, archive: bool,
+                         only_new: bool = False):
+    """
+    Yield streamed bank payment file, generated with own cursor
+    (cursor of the request is closed before response body is sent).
+    Nothing is committed if the client disconnects before the end of the file.
+    """
+    with Registry(db_name).cursor() as cr:
+        env = api.Environment(cr, uid, context)
+        yield from env['bank.payment']._iter_bank_payment_stream(
+            env['account.move'].browse(move_ids), archive, only_new)
+
+
+class BankPayment(models.TransientModel):
+    _name = 'bank.payment'
+    _description = 'Get txt file ready for import to bank'
+
+    validation_report = fields.Text(readonly=True)
+    only_new_bills = fields.Boolean(
+        string='Only Bills Not Exported Yet', default=True,
+        help="Skip selected bills that were already exported in a bank payment batch")
+    preview = fields.Text(compute='_compute_preview', help="Bill count and total amount of selected bills")
+    stream_move_ids = fields.Json(help="Ids of bills (in selection order) for streamed download")
+
+    def error_handler(self, move_name: str, field_name: str) -> None:
+        raise BankPaymentDataError(move_name, field_name)
 
     ####################################################
     # VALUES
     ####################################################
 
-    def _get_first_line_values(self) -> dict:
+    def _get_first_line_values(self, account: dict = None) -> FileHeader:
         """
-        return constant values for first line
+        return values for first line
+        account: paying account of the file (see _get_export_groups), current company if not given
         """
         today = format_date(self.env, fields.Date.to_string(fields.Date.today()), date_format='yyyyMMdd')
 
-        values = {
-            'trans_type': self._get_value_rule('trans_type', 'IB000000000000'),
-            'creation_date': self._get_value_rule('eksp_date', today),
-            'blank1': self._get_value_rule('blank90', ''),
-            'blank2': self._get_value_rule('blank255', ''),
-            'blank3': self._get_value_rule('blank255', ''),
-            'blank4': self._get_value_rule('blank255', '')
-        }
+        return FileHeader(
+            creation_date=today,
+            created_at=fields.Datetime.now().isoformat(timespec='seconds'),
+            initiating_party=account['company_name'] if account else self.env.company.name,
+        )
 
-        return values
-
-    def _get_last_line_values(self, total_lines: int, total_amount: int) -> dict:
+    def _get_last_line_values(self, total_lines: int, total_amount: int) -> FileFooter:
         """
-        return constant values for last line
+        return values for last line
         """
         today = format_date(self.env, fields.Date.to_string(fields.Date.today()), date_format='yyyyMMdd')
 
-        values = {
-            'trans_type': self._get_value_rule('trans_type', 'IB999999999999'),
-            'creation_date': self._get_value_rule('eksp_date', today),
-            'total_lines': self._get_value_rule('total_lines', str(total_lines)),
-            'total_amount': self._get_value_rule('total_amount', str(total_amount), plus_sign=True),
-            'blank1': self._get_value_rule('blank64', ''),
-            'blank2': self._get_value_rule('blank255', ''),
-            'blank3': self._get_value_rule('blank255', ''),
-            'blank4': self._get_value_rule('blank255', '')
-        }
+        return FileFooter(creation_date=today, total_lines=total_lines, total_amount=total_amount)
+
+    def _check_state(self, bill: dict) -> None:
+        """
+        only posted bills can be paid
+        """
+        if bill['state'] != 'posted':
+            self.error_handler(bill['name'], 'Status. Bill must be posted')
 
-        return values
+    def _get_trans_type(self, bill: dict) -> str:
+        """
+        return bank transfer type (defined in fiscal position), domestic by default
+        """
+        return bill['bank_trans_type'] or 'domestic'
 
-    def _get_trans_type(self, move_id: models.Model) -> str:
+    def _get_record_type(self, bill: dict) -> str:
         """
-        return transfer type (defined in fiscal position)
+        return record type of bank transfer type in file format of the bill
         """
-        trans_type = {
-            'domestic': 'IB030202000006',
-            'international': 'IB030204000004',
-            'payment_card': 'IB030207000002',
-        }
-        if move_id.fiscal_position_id:
-            if move_id.fiscal_position_id.bank_trans_type:
-                return trans_type[move_id.fiscal_position_id.bank_trans_type]
+        file_format = get_format(bill['file_format'])
+        record_type = file_format.get_record_type(self._get_trans_type(bill))
+        if not record_type:
+            self.error_handler(bill['name'], f'Bank transfer type (not supported by {file_format.name} format)')
 
-        return trans_type['domestic']
+        return record_type
 
-    def _get_from_type(self, move_id: models.Model) -> str:
+    def _get_from_type(self, bill: dict) -> str:
         """
         return from type (defined in res.partner.bank)
         """
-        if move_id.partner_bank_id:
-            if move_id.partner_bank_id.from_type:
-                return move_id.partner_bank_id.from_type
+        if bill['partner_bank_id']:
+            if bill['from_type']:
+                return bill['from_type']
             else:
-                self.error_handler(move_id.name, 'Partner Bank From Type')
+                self.error_handler(bill['name'], 'Partner Bank From Type')
         else:
-            self.error_handler(move_id.name, 'Recipient Bank')
+            self.error_handler(bill['name'], 'Recipient Bank')
 
-    def _get_from_account(self, move_id: models.Model) -> str:
+    def _get_from_account(self, bill: dict) -> str:
         """
         return company account number
         """
-        company_partner = move_id.company_id.partner_id
-        acc_number = company_partner.bank_ids
+        acc_number = bill['company_acc_number']
 
-        if acc_number:
-            if len(acc_number[0].acc_number) == 15:
-                return acc_number[0].acc_number
+        if acc_number is not None:
+            if len(acc_number) == 15:
+                return acc_number
             else:
-                self.error_handler(move_id.name, 'Company account number (total length should be 15)')
+                self.error_handler(bill['name'], 'Company account number (total length should be 15)')
         else:
-            self.error_handler(move_id.name, 'Company account number')
+            self.error_handler(bill['name'], 'Company account number')
 
-    def _get_partner_acc_number(self, move_id: models.Model) -> str:
+    def _get_partner_acc_number(self, bill: dict) -> str:
         """
         return partner account number
         """
-        partner_bank = move_id.partner_bank_id
-
-        if partner_bank:
-            acc_number = partner_bank.acc_number
+        if bill['partner_bank_id']:
+            acc_number = bill['acc_number']
             if len(acc_number) == 14:
                 return acc_number
             else:
-                self.error_handler(move_id.name, 'Recipient account number (total length should be 14)')
+                self.error_handler(bill['name'], 'Recipient account number (total length should be 14)')
         else:
-            self.error_handler(move_id.name, 'Recipient Bank')
+            self.error_handler(bill['name'], 'Recipient Bank')
 
-    def _get_transaction_option(self, move_id: models.Model) -> str:
+    def _get_transaction_option(self, bill: dict) -> str:
         """
         return transaction option (defined in payment terms)
         default: (1, Standard transfer)
         """
-        if move_id.invoice_payment_term_id and move_id.invoice_payment_term_id.transaction_option:
-            return str(move_id.invoice_payment_term_id.transaction_option)
+        if bill['transaction_option']:
+            return str(bill['transaction_option'])
 
         return '1'  # Standard transfer
 
-    def _get_payment_reference(self, move_id: models.Model) -> str:
+    def _get_payment_reference(self, bill: dict) -> str:
         """
         return journal text (Payment reference)
         """
-        if move_id.payment_reference:
-            return move_id.payment_reference
+        if bill['payment_reference']:
+            return bill['payment_reference']
 
         else:
-            self.error_handler(move_id.name, 'Payment reference')
+            self.error_handler(bill['name'], 'Payment reference')
 
-    def _get_notification_text(self, move_id: models.Model) -> str:
+    def _get_notification_text(self, bill: dict) -> list:
         """
-        Divide narration by paragraph
         return 5 notification text for bank import
+        (narration divided by paragraph, stored on account.move)
         """
-        narration_dict = {
-            'narration_text1': '',
-            'narration_text2': '',
-            'narration_text3': '',
-            'narration_text4': '',
-            'narration_text5': '',
-        }
+        if bill['notification_error']:
+            self.error_handler(bill['name'], bill['notification_error'])
 
-        narration = html2plaintext(move_id.narration)
-        if narration:
-            narrations = narration.split('\n')
-            if len(narrations) > 5:
-                self.error_handler(move_id.name, 'Narration (you can have max 5 paragraphs)')
+        if any(bill['notification_texts']):
+            return [text or '' for text in bill['notification_texts']]
 
-            for i in range(1, len(narrations) + 1):
-                if len(narrations[i - 1]) > 35:
-                    self.error_handler(
-                        move_id.name, f'Narration (every paragraph should be max length of 35). Problematic paragraph: {i}')
+        return [bill['name'], '', '', '', '']
 
-                narration_dict[f'narration_text{i}'] = narrations[i - 1]
-
-        else:
-            narration_dict['narration_text1'] = move_id.name
-
-        return [value for value in narration_dict.values()]
-
-    def _get_document_reference(self, move_id: models.Model) -> str:
+    def _get_document_reference(self, bill: dict) -> str:
         """
         return document reference (origin or bill reference)
         """
-        if move_id.invoice_origin:
-            return move_id.invoice_origin
+        if bill['invoice_origin']:
+            return bill['invoice_origin']
 
-        elif move_id.ref:
-            return move_id.ref
+        elif bill['ref']:
+            return bill['ref']
 
         else:
-            self.error_handler(move_id.name, 'Bill reference')
+            self.error_handler(bill['name'], 'Bill reference')
 
-    def _get_transfer_type(self, move_id: models.Model) -> str:
+    def _get_transfer_type(self, bill: dict) -> str:
         """
         return transfer type
         """
-        if move_id.invoice_payment_term_id:
-            transfer_type = move_id.invoice_payment_term_id.transfer_type
-            if transfer_type:
-                return transfer_type
+        if bill['transfer_type']:
+            return bill['transfer_type']
 
         return '53'  # default value (53, Standard transfer)
 
-    def _get_recipient_acc_number(self, move_id: models.Model) -> str:
+    def _get_recipient_acc_number(self, bill: dict) -> tuple:
         """
         return IBAN and SWIFT
         """
-        partner_bank = move_id.partner_bank_id
-
-        if partner_bank:
-            acc_number = partner_bank.acc_number
-            bank_id = partner_bank.bank_id
-            if bank_id:
-                swift_code = partner_bank.bank_id.bic
+        if bill['partner_bank_id']:
+            if bill['bank_id']:
+                swift_code = bill['bic']
                 if swift_code:
-                    return acc_number, swift_code
+                    return bill['acc_number'], swift_code
                 else:
-                    self.error_handler(move_id.name, 'Partner Bank SWIFT/BIC Code')
+                    self.error_handler(bill['name'], 'Partner Bank SWIFT/BIC Code')
             else:
-                self.error_handler(move_id.name, 'Partner Bank')
+                self.error_handler(bill['name'], 'Partner Bank')
 
         else:
-            self.error_handler(move_id.name, 'Recipient Bank')
+            self.error_handler(bill['name'], 'Recipient Bank')
 
-    def _get_card_code(self, move_id: models.Model) -> str:
+    def _get_debtor_account(self, bill: dict) -> str:
+        """
+        return company account number (IBAN)
+        """
+        if bill['company_acc_number']:
+            return bill['company_acc_number']
+
+        self.error_handler(bill['name'], 'Company account number')
+
+    def _get_card_code(self, bill: dict) -> str:
         """
         return card code
         """
-        if move_id.partner_bank_id:
-            if move_id.partner_bank_id.card_code:
-                return move_id.partner_bank_id.card_code
+        if bill['partner_bank_id']:
+            if bill['card_code']:
+                return bill['card_code']
             else:
-                self.error_handler(move_id.name, 'Card Code (defined in partner bank)')
+                self.error_handler(bill['name'], 'Card Code (defined in partner bank)')
         else:
-            self.error_handler(move_id.name, 'Recipient Bank')
+            self.error_handler(bill['name'], 'Recipient Bank')
 
     ####################################################
-    # DATA
+    # PREFETCH
     ####################################################
 
-    def _generate_data_line(self, **kwargs):
-        """
-        Generate line for data text.
-        Here we implement logic for commas.
-        """
-        data = ''
-        for value in kwargs.values():
-            data += value + ','
-
-        data = data[:-1]  # remove last comma
-
-        return data
-
-    def _prepare_bank_payment_data(self, move_ids: models.Model) -> str:
-        """
-        Prepare data with textual values that will be in bank payment file
-        """
-        data = ''
-
-        data += self._generate_data_line(**self._get_first_line_values()) + '\n'
-
-        total_amount = 0
-        total_lines = 0
-        for move in move_ids:
-            if move.state != 'posted':
-                self.error_handler(move.name, 'Status. Bill must be posted')
-
-            total_lines += 1
-            # MONETARY FIELDS
-            trans_type = self._get_value_rule('trans_type', self._get_trans_type(move))
-            index = self._get_value_rule('index', '0001')  # constant value
-            eksp_date = format_date(self.env, fields.Date.to_string(move.invoice_date_due), date_format='yyyyMMdd')
-            eksp_date = self._get_value_rule('eksp_date', eksp_date)
-            amount = int(move.amount_total * 100)
-            total_amount += amount
-            amount = self._get_value_rule('amount', str(amount), True)
-            currency = self._get_value_rule('currency', move.currency_id.name)
-            from_type = self._get_value_rule('from_type', self._get_from_type(move))
-            from_account = self._get_value_rule('from_account', self._get_from_account(move))
-            transaction_type = self._get_value_rule('transaction_type', '2')  # constant value
-            transaction_option = self._get_value_rule('from_type', self._get_transaction_option(move))
-            journal_text = self._get_value_rule('journal_text', self._get_payment_reference(move))
-            transfer_type = self._get_value_rule('transfer_type', self._get_transfer_type(move))
-            recipient_acc_number, swift_number = self._get_recipient_acc_number(move)
-            recipient_acc_number = self._get_value_rule('recipient_acc_number', recipient_acc_number)
-            swift_number = self._get_value_rule('swift_number', swift_number)
-            payment_id = self._get_value_rule('payment_id', self._get_payment_reference(move))
-
-            # NON-MONETARY FIELDS
-            partner_id = move.partner_id
-            name = partner_id.name or ''
-            partner_name = self._get_value_rule('name', name)
-            recipient = self._get_value_rule('recipient', name)
-            street = partner_id.street or ''
-            partner_street = self._get_value_rule('street', street)
-            recipient_street = self._get_value_rule('recipient_street', street)
-            street2 = partner_id.street2 or ''
-            partner_street2 = self._get_value_rule('street2', street2)
-            recipient_street2 = self._get_value_rule('recipient_street2', street2)
-            recipient_country = partner_id.country_id.name or ''
-            recipient_country = self._get_value_rule('recipient_country', recipient_country)
-            zip_code = partner_id.zip or ''
-            partner_zip_code = self._get_value_rule('zip_code', zip_code)
-            city = partner_id.city or ''
-            partner_city = self._get_value_rule('city', city)
-            journal_name = self._get_value_rule('journal_name', move.journal_id.name)
-
-            # GROUP OF FIELDS WHERE ONE OF THEM HAS TO BE FIELD
-            narration_text1, narration_text2, narration_text3, narration_text4, narration_text5 = self._get_notification_text(move)  # noqa
-            notification_text1 = self._get_value_rule('notification_text', narration_text1)
-            notification_text2 = self._get_value_rule('notification_text', narration_text2)
-            notification_text3 = self._get_value_rule('notification_text', narration_text3)
-            notification_text4 = self._get_value_rule('notification_text', narration_text4)
-            notification_text5 = self._get_value_rule('notification_text', narration_text5)
-            document_reference = self._get_value_rule('document_reference', self._get_document_reference(move))
-
-            # BLANK VALUES
-            blank2 = self._get_value_rule('blank2', '')
-            blank3 = self._get_value_rule('blank3', '')
-            blank4 = self._get_value_rule('blank4', '')
-            blank6 = self._get_value_rule('blank6', '')
-            blank8 = self._get_value_rule('blank8', '')
-            blank10 = self._get_value_rule('blank10', '')
-            blank14 = self._get_value_rule('blank14', '')
-            blank16 = self._get_value_rule('blank16', '')
-            blank24 = self._get_value_rule('blank24', '')
-            blank32 = self._get_value_rule('blank32', '')
-            blank35 = self._get_value_rule('blank35', '')
-            blank45 = self._get_value_rule('blank45', '')
-            blank75 = self._get_value_rule('blank75', '')
-            blank215 = self._get_value_rule('blank215', '')
-
-            data_values = OrderedDict()
-            if self._get_trans_type(move) == 'IB030202000006':  # domestic
-                partner_acc_number = self._get_partner_acc_number(move)
-                cust_reg = self._get_value_rule('cust_reg', partner_acc_number[:4])
-                cust_acc = self._get_value_rule('cust_acc', partner_acc_number[4:])
-
-                data_values = OrderedDict({
-                    "trans_type": trans_type,
-                    "index": index,
-                    "eksp_date": eksp_date,
-                    "amount": amount,
-                    "currency": currency,
-                    "from_type": from_type,
-                    "from_account": from_account,
-                    "transaction_type": transaction_type,
-                    "cust_reg": cust_reg,
-                    "cust_acc": cust_acc,
-                    "transaction_option": transaction_option,
-                    "journal_text": journal_text,
-                    "name": partner_name,
-                    "street": partner_street,
-                    "street2": partner_street2,
-                    "zip_code": partner_zip_code,
-                    "city": partner_city,
-                    "own_journal_number": move.name,
-                    'notification_text1': notification_text1,
-                    'notification_text2': notification_text2,
-                    'notification_text3': notification_text3,
-                    'notification_text4': notification_text4,
-                    'notification_text5': notification_text5,
-                    "blank1": blank35,
-                    "document_reference": document_reference,
-                    "blank2": blank35,
-                    "blank3": blank35,
-                    "blank4": blank35,
-                    "blank5": blank3,
-                    "blank6": blank35,
-                    "blank7": blank35,
-                    "blank8": blank35,
-                    "blank9": blank35,
-                    "blank10": blank6,
-                    "blank11": blank14
-                })
-            elif self._get_trans_type(move) == 'IB030204000004':  # international
-                data_values = OrderedDict({
-                    "trans_type": trans_type,
-                    "index": index,
-                    "eksp_date": eksp_date,
-                    "amount": amount,
-                    "from_type": from_type,
-                    "from_account": from_account,
-                    "currency": currency,
-                    "transfer_currency": currency,
-                    "transfer_type": transfer_type,
-                    "payment_text1": document_reference,
-                    "payment_text2": blank35,
-                    "payment_text3": blank35,
-                    "payment_text4": blank35,
-                    "recipient": recipient,
-                    "recipient_street": recipient_street,
-                    "recipient_street2": recipient_street2,
-                    "recipient_country": recipient_country,
-                    "recipient_acc_number": recipient_acc_number,
-                    "swift_number": swift_number,
-                    "blank1": blank45,
-                    "blank2": blank75,
-                    "blank3": blank75,
-                    "blank4": blank24,
-                    "blank5": blank215
-                })
-            elif self._get_trans_type(move) == 'IB030207000002':  # payment_card
-                card_code = self._get_value_rule('card_code', self._get_card_code(move)
-                                                 )  # Specific for Payment card only
-
-                data_values = OrderedDict({
-                    "trans_type": trans_type,
-                    "index": index,
-                    "eksp_date": eksp_date,
-                    "amount": amount,
-                    "from_type": from_type,
-                    "from_account": from_account,
-                    "card_code": card_code,
-                    "payment_id": payment_id,
-                    "blank1": blank4,
-                    "blank2": blank10,
-                    "blank3": blank8,
-                    "recipient_name": partner_name,
-                    "blank4": blank32,
-                    "journal_nr": document_reference,
-                    "blank5": blank35,
-                    "blank6": blank35,
-                    "blank7": blank35,
-                    "blank8": blank35,
-                    "blank9": blank35,
-                    "blank10": blank35,
-                    "blank11": blank35,
-                    "blank12": blank35,
-                    "blank13": blank35,
-                    "blank14": blank35,
-                    "blank15": blank35,
-                    "blank16": blank16,
-                    "blank17": blank215,
-                })
+    def _read_by_id(self, model_name: str, ids, field_names: list) -> dict:
+        """
+        return {id: values} read in bulk (many2one fields as plain ids)
+        """
+        ids = {id_ for id_ in ids if id_}
+        if not ids:
+            return {}
+
+        records = self.env[model_name].browse(ids)
+        return {values['id']: values for values in records.read(field_names, load=None)}
+
+    def _get_company_bank_accounts(self, company_ids) -> dict:
+        """
+        return {company id: values of first company bank account (paying account)}
+        """
+        companies = self._read_by_id('res.company', company_ids, ['partner_id', 'name'])
+        company_by_partner = {company['partner_id']: company_id for company_id, company in companies.items()}
+        accounts = {}
+        # default order of res.partner.bank is the same as of partner.bank_ids
+        for bank in self.env['res.partner.bank'].search_read(
+                [('partner_id', 'in', list(company_by_partner))],
+                ['partner_id', 'acc_number', 'bank_id', 'bank_file_format'], load=None):
+            accounts.setdefault(company_by_partner[bank['partner_id']], bank)
+
+        banks = self._read_by_id('res.bank', [account['bank_id'] for account in accounts.values()], ['bic'])
+        return {
+            company_id: {
+                'company_name': company['name'],
+                'acc_number': accounts.get(company_id, {}).get('acc_number'),
+                'bic': banks.get(accounts.get(company_id, {}).get('bank_id'), {}).get('bic'),
+                'file_format': accounts.get(company_id, {}).get('bank_file_format') or DEFAULT_FORMAT,
+            }
+            for company_id, company in companies.items()
+        }
+
+    def _get_file_format(self, move_ids: models.Model) -> BankFileFormat:
+        """
+        return format of bank payment file (selected on paying bank account of the bills)
+        """
+        company_ids = [company.id for [company] in self.env['account.move']._read_group(
+            [('id', 'in', move_ids.ids)], ['company_id'])]
+        codes = {account['file_format'] for account in self._get_company_bank_accounts(company_ids).values()}
+        if len(codes) > 1:
+            raise UserError("Selected bills are paid from bank accounts with different bank file formats. "
+                            "Export them separately.")
+
+        return get_format(codes.pop() if codes else DEFAULT_FORMAT)
+
+    def _split_by_file_format(self, move_ids: models.Model) -> dict:
+        """
+        return {file format code: bills paid from bank accounts of that format}, bills keep move_ids order
+        """
+        Move = self.env['account.move']
+        groups = Move._read_group([('id', 'in', move_ids.ids)], ['company_id'], ['id:array_agg'])
+        accounts = self._get_company_bank_accounts([company.id for company, _ids in groups])
+        code_by_move = {}
+        for company, ids in groups:
+            code_by_move.update(dict.fromkeys(ids, accounts[company.id]['file_format']))
+
+        result = {}
+        for move_id in move_ids.ids:
+            result.setdefault(code_by_move[move_id], []).append(move_id)
+        return {code: Move.browse(ids) for code, ids in result.items()}
+
+    def _get_export_groups(self, move_ids: models.Model) -> list:
+        """
+        Group bills by company and its paying bank account (first bank account of the company),
+        values of the paying account are read once per group
+        return: [(paying account values with company_id, bills of the group), ...]
+            groups are ordered by their first bill, bills keep move_ids order
+        """
+        Move = self.env['account.move']
+        company_by_move = {}
+        for company, ids in Move._read_group([('id', 'in', move_ids.ids)], ['company_id'], ['id:array_agg']):
+            company_by_move.update(dict.fromkeys(ids, company.id))
+        accounts = self._get_company_bank_accounts(set(company_by_move.values()))
+
+        groups = {}
+        for move_id in move_ids.ids:
+            company_id = company_by_move[move_id]
+            groups.setdefault((company_id, accounts[company_id]['acc_number']), []).append(move_id)
+
+        return [
+            (dict(accounts[company_id], company_id=company_id), Move.browse(ids))
+            for (company_id, _acc_number), ids in groups.items()
+        ]
+
+    def _prefetch_bills(self, move_ids: models.Model) -> list:
+        """
+        Read everything export needs for all bills in a few bulk reads
+        return: list of flat dicts (one per bill, in move_ids order)
+        """
+        moves = move_ids.read([
+            'name', 'state', 'invoice_date_due', 'amount_total', 'currency_id', 'payment_reference',
+            'invoice_origin', 'ref', 'partner_id', 'partner_bank_id', 'company_id', 'fiscal_position_id',
+            'invoice_payment_term_id', 'bank_notification_text1', 'bank_notification_text2',
+            'bank_notification_text3', 'bank_notification_text4', 'bank_notification_text5',
+            'bank_notification_error', 'bank_payment_row', 'bank_payment_fingerprint',
+        ], load=None)
+
+        def related(model_name, field_name, field_names):
+            return self._read_by_id(model_name, [move[field_name] for move in moves], field_names)
+
+        currencies = related('res.currency', 'currency_id', ['name'])
+        partners = related('res.partner', 'partner_id', ['name', 'street', 'street2', 'zip', 'city', 'country_id'])
+        partner_banks = related('res.partner.bank', 'partner_bank_id', ['acc_number', 'bank_id', 'from_type', 'card_code'])
+        fiscal_positions = related('account.fiscal.position', 'fiscal_position_id', ['bank_trans_type'])
+        payment_terms = related('account.payment.term', 'invoice_payment_term_id', ['transaction_option', 'transfer_type'])
+        banks = self._read_by_id('res.bank', [bank['bank_id'] for bank in partner_banks.values()], ['bic'])
+        countries = self._read_by_id('res.country', [partner['country_id'] for partner in partners.values()], ['name', 'code'])
+        company_accounts = self._get_company_bank_accounts([move['company_id'] for move in moves])
+
+        bills = []
+        for move in moves:
+            partner = partners.get(move['partner_id'], {})
+            partner_bank = partner_banks.get(move['partner_bank_id'], {})
+            payment_term = payment_terms.get(move['invoice_payment_term_id'], {})
+            company_account = company_accounts.get(move['company_id'], {})
+            country = countries.get(partner.get('country_id'), {})
+            bill = {
+                'id': move['id'],
+                'name': move['name'],
+                'state': move['state'],
+                'invoice_date_due': move['invoice_date_due'],
+                'amount_total': move['amount_total'],
+                'currency': currencies.get(move['currency_id'], {}).get('name'),
+                'payment_reference': move['payment_reference'],
+                'notification_texts': [move[f'bank_notification_text{i}'] for i in range(1, 6)],
+                'notification_error': move['bank_notification_error'],
+                'invoice_origin': move['invoice_origin'],
+                'ref': move['ref'],
+                'company_id': move['company_id'],
+                'company_name': company_account.get('company_name'),
+                'company_acc_number': company_account.get('acc_number'),
+                'company_bic': company_account.get('bic'),
+                'file_format': company_account.get('file_format', DEFAULT_FORMAT),
+                'bank_trans_type': fiscal_positions.get(move['fiscal_position_id'], {}).get('bank_trans_type'),
+                'transaction_option': payment_term.get('transaction_option'),
+                'transfer_type': payment_term.get('transfer_type'),
+                'partner_bank_id': move['partner_bank_id'],
+                'acc_number': partner_bank.get('acc_number'),
+                'from_type': partner_bank.get('from_type'),
+                'card_code': partner_bank.get('card_code'),
+                'bank_id': partner_bank.get('bank_id'),
+                'bic': banks.get(partner_bank.get('bank_id'), {}).get('bic'),
+                'partner_id': move['partner_id'],
+                'partner_name': partner.get('name'),
+                'street': partner.get('street'),
+                'street2': partner.get('street2'),
+                'zip': partner.get('zip'),
+                'city': partner.get('city'),
+                'country': country.get('name'),
+                'country_code': country.get('code'),
+            }
+            bill['fingerprint'] = self._get_bill_fingerprint(bill)
+            if move['bank_payment_fingerprint'] == bill['fingerprint']:
+                bill['cached_row'] = move['bank_payment_row']
             else:
-                raise UserError(f"""
-                Something went wrong. Contact your administrator!
-                Invoice number: {move.name}
-                """)
+                bill['cached_row'] = None
+            bills.append(bill)
 
-            data += self._generate_data_line(**data_values) + '\n'
+        return bills
 
-        data += self._generate_data_line(**self._get_last_line_values(total_lines, total_amount))
+    def _get_export_chunk_size(self) -> int:
+        return int(self.env['ir.config_parameter'].sudo().get_param('bank_payment.export_chunk_size', EXPORT_CHUNK_SIZE))
 
-        return data
+    def _iter_prefetched_chunks(self, move_ids: models.Model, metrics: ExportMetrics = None):
+        """
+        Yield prefetched bills chunk by chunk (in move_ids order).
+        ORM cache is dropped after each chunk (pending changes are flushed first),
+        so memory used depends on chunk size, not on number of bills.
+        """
+        metrics = metrics or ExportMetrics(self.env.cr)
+        for chunk_ids in split_every(self._get_export_chunk_size(), move_ids.ids, list):
+            with metrics.stage('prefetch'):
+                bills = self._prefetch_bills(self.env['account.move'].browse(chunk_ids))
+            metrics.add('prefetch', row_count=len(bills))
+            yield bills
+            self.env.invalidate_all()
 
-    def action_download_bank_payment(self):
+    def _get_bill_fingerprint(self, bill: dict) -> str:
+        """
+        return hash of all bill values its rendered row depends on
+        (amount, due date, partner address, bank accounts, fiscal position, payment term, narration, ...)
+        """
+        values = [ROW_CACHE_VERSION] + [(key, bill[key]) for key in sorted(bill)]
+        return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+
+    ####################################################
+    # PREVIEW
+    ####################################################
+
+    def _get_preview_domain(self) -> list:
+        """
+        return domain of bills selected for export (same selection as _get_move_ids)
+        """
+        domain = [('id', 'in', self.env.context.get('active_ids') or [])]
+        if self.only_new_bills:
+            domain.append(('bank_payment_batch_id', '=', False))
+        return domain
+
+    def _get_preview_groups(self, domain: list) -> dict:
+        """
+        return {section: [(label, bill count, total amount), ...]} computed by SQL aggregates
+        (amounts are summed as in bank payment file, without currency conversion)
+        """
+        Move = self.env['account.move']
+        aggregates = ['__count', 'amount_total:sum']
+        trans_type_labels = dict(self.env['account.fiscal.position']._fields['bank_trans_type'].selection)
+
+        trans_types = {}
+        for position, count, amount in Move._read_group(domain, ['fiscal_position_id'], aggregates):
+            label = trans_type_labels[position.bank_trans_type or 'domestic']
+            total = trans_types.setdefault(label, [0, 0.0])
+            total[0] += count
+            total[1] += amount
+
+        return {
+            'Transaction type': [(label, count, amount) for label, (count, amount) in sorted(trans_types.items())],
+            'Currency': [
+                (currency.name, count, amount)
+                for currency, count, amount in Move._read_group(domain, ['currency_id'], aggregates, order='currency_id')
+            ],
+            'Due date': [
+                (format_date(self.env, due_date) if due_date else 'None', count, amount)
+                for due_date, count, amount in Move._read_group(
+                    domain, ['invoice_date_due:day'], aggregates, order='invoice_date_due:day')
+            ],
+            # bills of every company are exported into separate file(s)
+            'Company': [
+                (company.name, count, amount)
+                for company, count, amount in Move._read_group(domain, ['company_id'], aggregates, order='company_id')
+            ],
+        }
+
+    def _format_preview(self, groups: dict) -> str:
+        """
+        return preview as text
+        """
+        rows = groups['Transaction type']
+        lines = [f"{sum(row[1] for row in rows)} bill(s), total amount {sum(row[2] for row in rows):,.2f}"]
+        for section, rows in groups.items():
+            lines.append('')
+            lines.append(section)
+            lines.extend(f"    {label:<30} {count:>8} {amount:>20,.2f}" for label, count, amount in rows)
+
+        return '\n'.join(lines)
+
+    @api.depends('only_new_bills')
+    def _compute_preview(self):
+        for wizard in self:
+            wizard.preview = wizard._format_preview(wizard._get_preview_groups(wizard._get_preview_domain()))
+
+    ####################################################
+    # VALIDATION
+    ####################################################
+
+    def _get_bill_errors(self, bill: dict) -> list:
+        """
+        Run all checks of one bill, without stopping on the first one
+        return: list of missing/invalid fields (empty if bill is fine)
+        """
+        checks = [self._check_state, self._get_record_type] + get_format(bill['file_format']).get_checks(self, bill)
+        errors = []
+        for check in checks:
+            try:
+                check(bill)
+            except BankPaymentDataError as error:
+                if error.field_name not in errors:
+                    errors.append(error.field_name)
+
+        return errors
+
+    def _validate_bank_payment_data(self, bills: list) -> list:
+        """
+        Check all bills in one pass (bills already marked as ready are not checked again,
+        unless their readiness is outdated by change of company bank accounts)
+        return: [{'id': move id, 'name': move name, 'errors': [field, ...]}, ...] for bills with problems
+        """
+        ready_ids = set(self.env['account.move'].search([
+            ('id', 'in', [bill['id'] for bill in bills]),
+            ('bank_payment_ready', '=', True),
+            ('bank_payment_ready_outdated', '=', False),
+        ]).ids)
+
+        report = []
+        for bill in bills:
+            if bill['id'] in ready_ids or bill['cached_row']:
+                continue
+
+            errors = self._get_bill_errors(bill)
+            if errors:
+                report.append({'id': bill['id'], 'name': bill['name'], 'errors': errors})
+
+        return report
+
+    def _format_validation_report(self, report: list) -> str:
+        """
+        return validation report as text
         """
-        return: download bank payment file
+        lines = []
+        for bill in report:
+            lines.append(f"Invoice number: {bill['name']}")
+            lines.extend(f"    Missing field: {field_name}" for field_name in bill['errors'])
+
+        return '\n'.join(lines)
+
+    ####################################################
+    # DATA
+    ####################################################
+
+    def _get_move_values(self, bill: dict, cache: ExportCache) -> Payment:
+        """
+        return raw (not formatted) values of one bill as payment record
+        """
+        self._check_state(bill)
+
+        eksp_date = cache.dates.get(bill['invoice_date_due'], lambda: format_date(
+            self.env, fields.Date.to_string(bill['invoice_date_due']), date_format='yyyyMMdd'))
+
+        payment = Payment(
+            trans_type=self._get_record_type(bill),
+            eksp_date=eksp_date,
+            amount=int(bill['amount_total'] * 100),
+            currency=bill['currency'],
+            journal_text=self._get_payment_reference(bill),
+        )
+        payment.recipient_acc_number, payment.swift_number = self._get_recipient_acc_number(bill)
+        payment.name = bill['partner_name'] or ''
+        payment.street = bill['street'] or ''
+        payment.street2 = bill['street2'] or ''
+        payment.country = bill['country'] or ''
+        payment.zip_code = bill['zip'] or ''
+        payment.city = bill['city'] or ''
+        payment.own_journal_number = bill['name']
+        payment.partner_id = bill['partner_id']
+
+        get_format(bill['file_format']).set_payment_values(self, bill, payment, cache)
+        return payment
+
+    def _get_first_line(self, file_format: BankFileFormat, total_lines: int = 0, total_amount: int = 0,
+                        account: dict = None) -> str:
+        return file_format.first_line(
+            self._get_first_line_values(account), self._get_last_line_values(total_lines, total_amount))
+
+    def _get_last_line(self, file_format: BankFileFormat, total_lines: int, total_amount: int,
+                       account: dict = None) -> str:
+        return file_format.last_line(
+            self._get_first_line_values(account), self._get_last_line_values(total_lines, total_amount))
+
+    def _render_bill(self, bill: dict, cache: ExportCache) -> tuple:
+        """
+        return: rendered line of one bill and its amount (in cents)
+        """
+        payment = self._get_move_values(bill, cache)
+        try:
+            return get_format(bill['file_format']).render_payment(payment, cache), payment.amount
+        except ValueError:
+            raise UserError(f"""
+            Something went wrong. Contact your administrator!
+            Invoice number: {bill['name']}
+            """)
+
+    def _render_bills(self, bills: list, cache: ExportCache, rendered: dict):
+        """
+        Yield rendered row and amount (in cents) of every bill.
+        Row cached on the bill is used if its fingerprint did not change,
+        other bills are rendered and their rows are collected in `rendered` (see _store_rendered_rows)
+        """
+        for bill in bills:
+            if bill['cached_row']:
+                yield bill['cached_row'], int(bill['amount_total'] * 100)
+                continue
+
+            line, amount = self._render_bill(bill, cache)
+            rendered[bill['id']] = (line, bill['fingerprint'])
+            yield line, amount
+
+    @api.model
+    def _store_rendered_rows(self, rendered: dict) -> None:
+        """
+        Store rendered rows with fingerprints on bills, in bulk and without ORM write of posted bills
+        rendered: {move id: (row, fingerprint)}
+        """
+        for rows in split_every(1000, rendered.items(), list):
+            self.env.cr.execute(f"""
+                UPDATE account_move
+                   SET bank_payment_row = v.row, bank_payment_fingerprint = v.fingerprint
+                  FROM (VALUES {', '.join(['%s'] * len(rows))}) AS v(id, row, fingerprint)
+                 WHERE account_move.id = v.id
+            """, [(move_id, row, fingerprint) for move_id, (row, fingerprint) in rows])
+        if rendered:
+            self.env['account.move'].invalidate_model(['bank_payment_row', 'bank_payment_fingerprint'])
+
+    def _raise_validation_report(self, report: list) -> None:
+        raise UserError(f"""
+        Insufficient data!!
+        {len(report)} bill(s) can not be exported:
+
+{self._format_validation_report(report)}
+        """)
+
+    def _raise_skipped_bills(self, skipped: models.Model) -> None:
+        raise UserError(
+            f"{len(skipped)} selected bill(s) are being exported by another run or were exported meanwhile, "
+            f"export the selection again:\n" + '\n'.join(skipped.mapped('name')))
+
+    def _get_export_workers(self) -> int:
+        """
+        return number of worker processes rendering chunks of background jobs (0 or 1 disables it).
+        Workers are forked, which is safe only in single-threaded processes, so they are used
+        only when server runs in prefork mode (jobs are processed by cron worker process),
+        never in threaded mode and never in HTTP requests (wizard downloads).
+        """
+        if not config['workers']:
+            return 0
+        return int(self.env['ir.config_parameter'].sudo().get_param('bank_payment.export_workers', 0))
+
+    def _render_bill_chunk(self, move_ids: list, metrics: ExportMetrics, cache: ExportCache = None,
+                           store: bool = True, validate_only: bool = False) -> tuple:
+        """
+        Prefetch, validate and render one chunk of bills (see _render_bills), shared by downloads,
+        background jobs and their worker processes
+        store: store newly rendered rows on bills (see _store_rendered_rows)
+        validate_only: bills are only validated (export already has invalid bills)
+        return: (rendered rows, their amounts, validation report, newly rendered rows)
+        """
+        with metrics.stage('prefetch'):
+            bills = self._prefetch_bills(self.env['account.move'].browse(move_ids))
+        metrics.add('prefetch', row_count=len(bills))
+        with metrics.stage('validate'):
+            report = self._validate_bank_payment_data(bills)
+        metrics.add('validate', row_count=len(bills))
+        if report or validate_only:
+            return [], [], report, {}
+
+        rendered = {}
+        lines = []
+        amounts = []
+        with metrics.stage('render'):
+            for line, amount in self._render_bills(bills, cache or ExportCache(), rendered):
+                lines.append(line)
+                amounts.append(amount)
+            if store:
+                self._store_rendered_rows(rendered)
+        metrics.add('render', row_count=len(rendered))
+        return lines, amounts, report, rendered
+
+    def _render_bills_parallel(self, move_ids: list, workers: int, metrics: ExportMetrics) -> tuple:
+        """
+        Render shards of bills in worker processes (each with own connection and cursor).
+        Shards are merged in order of move_ids.
+        Workers read committed data only, so bills and everything they depend on
+        must be committed before (background jobs commit after every chunk).
+        return: (rendered rows, their amounts, validation report)
+        """
+        shards = list(split_every(SHARD_SIZE, move_ids, list))
+        with metrics.stage('render_parallel'), ProcessPoolExecutor(
+                max_workers=min(workers, len(shards)),
+                mp_context=multiprocessing.get_context('fork'),
+                initializer=_init_shard_worker,
+                initargs=(self.env.cr.dbname,)) as executor:
+            results = list(executor.map(
+                _render_shard,
+                [self.env.uid] * len(shards),
+                [dict(self.env.context)] * len(shards),
+                shards,
+            ))
+
+        metrics.add('render_parallel', row_count=sum(len(result[0]) for result in results))
+        report = [bill for result in results for bill in result[2]]
+        if report:
+            return [], [], report
+
+        lines = []
+        amounts = []
+        with metrics.stage('write'):
+            for shard_lines, shard_amounts, _report, rendered in results:
+                self._store_rendered_rows(rendered)
+                lines += shard_lines
+                amounts += shard_amounts
+        return lines, amounts, report
+
+    def _iter_bank_payment_rows(self, move_ids: models.Model, metrics: ExportMetrics = None):
+        """
+        Yield rendered payment row and its amount (in cents) of every bill.
+        Bills are processed in chunks, once any chunk has invalid bills, the rest is only
+        validated and report of all problems is raised at the end.
+        metrics: collects duration of export stages (rows of a chunk are yielded after its render stage,
+        so writing and sending of the rows is not measured as rendering)
+        """
+        metrics = metrics or ExportMetrics(self.env.cr)
+        cache = ExportCache()
+        report = []
+        for chunk_ids in split_every(self._get_export_chunk_size(), move_ids.ids, list):
+            lines, amounts, chunk_report, _rendered = self._render_bill_chunk(
+                chunk_ids, metrics, cache, validate_only=bool(report))
+            report += chunk_report
+            # ORM cache is dropped after each chunk (see _iter_prefetched_chunks)
+            self.env.invalidate_all()
+            yield from zip(lines, amounts)
+
+        if report:
+            self._raise_validation_report(report)
+
+    def _get_file_limits(self) -> tuple:
+        """
+        return maximum rows (0 = no limit) and maximum total amount (in cents) of one bank payment file
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        return (
+            int(get_param('bank_payment.file_max_lines', 0)),
+            int(get_param('bank_payment.file_max_amount', 0)) or MAX_FILE_AMOUNT,
+        )
+
+    @api.model
+    def _get_file_charset(self, file_format: BankFileFormat = None) -> str:
+        """
+        return charset of bank payment file (required by format or expected by the bank)
+        """
+        if file_format and file_format.charset:
+            return file_format.charset
+        return self.env['ir.config_parameter'].sudo().get_param('bank_payment.file_charset', DEFAULT_CHARSET)
+
+    def _get_file_splitter(self, file_format: BankFileFormat, open_stream=None,
+                           account: dict = None) -> BankFileSplitter:
+        """
+        return splitter writing rows into spooled files (or streams given by open_stream)
+        within file limits, encoded in bank charset
+        account: paying account the files are framed for (see _get_export_groups)
+        """
+        max_lines, max_amount = self._get_file_limits()
+        return BankFileSplitter(
+            open_stream or (lambda: tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)),
+            lambda total_lines, total_amount: self._get_first_line(file_format, total_lines, total_amount, account),
+            lambda total_lines, total_amount: self._get_last_line(file_format, total_lines, total_amount, account),
+            max_lines,
+            max_amount,
+            self._get_file_charset(file_format),
+            file_format.header_needs_totals,
+        )
+
+    def _write_bank_payment_files(self, move_ids: models.Model, file_format: BankFileFormat,
+                                  metrics: ExportMetrics = None) -> list:
+        """
+        Write bank payment rows into separate files for every company and paying account,
+        each split into as many files as file limits require
+        return: (stream, total lines, total amount) of every file
+        """
+        groups = self._get_export_groups(move_ids)
+        move_ids = self.env['account.move'].browse(
+            [move_id for _account, group_ids in groups for move_id in group_ids.ids])
+        metrics = metrics or ExportMetrics(self.env.cr)
+        return self._write_grouped_files(
+            groups, self._iter_bank_payment_rows(move_ids, metrics), file_format, metrics)
+
+    def _write_grouped_files(self, groups: list, rows, file_format: BankFileFormat,
+                             metrics: ExportMetrics = None) -> list:
+        """
+        Write rows (one per bill, in order of the bills of groups) into files framed for paying account of their group
+        metrics: collects duration of writing (charset translation, encoding and file I/O) as 'write' stage,
+        time spent producing the rows is not included
+        return: (stream, total lines, total amount) of every file, group by group
+        """
+        metrics = metrics or ExportMetrics(self.env.cr)
+        splitters = [self._get_file_splitter(file_format, account=account) for account, _group_ids in groups]
+        bill_splitters = [splitter for splitter, (_account, group_ids) in zip(splitters, groups) for _move in group_ids.ids]
+        row_count = 0
+        write_time = 0.0
+        for line, amount in rows:
+            if row_count == len(bill_splitters):
+                raise ValueError(f"More rendered rows than {len(bill_splitters)} bills")
+            start = time.perf_counter()
+            bill_splitters[row_count].write(line, amount)
+            write_time += time.perf_counter() - start
+            row_count += 1
+        if row_count != len(bill_splitters):
+            raise ValueError(f"{row_count} rendered rows for {len(bill_splitters)} bills")
+        metrics.add('write', write_time, row_count=row_count)
+        with metrics.stage('write'):
+            return [file for splitter in splitters for file in splitter.close()]
+
+    @api.model
+    def _create_bank_payment_attachment(self, files: list, file_format: BankFileFormat):
+        """
+        Store bank payment file as attachment, several files are stored together in one zip archive.
+        Streams of files are closed.
+        return: attachment (existing one if file with the same content was already exported)
+        """
+        if len(files) == 1:
+            stream = files[0][0]
+            attachment = self._get_export_attachment(
+                f'bank_payment.{file_format.file_extension}', stream, file_format.mimetype)
+            stream.close()
+            return attachment
+
+        with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as archive_stream:
+            with zipfile.ZipFile(archive_stream, 'w', zipfile.ZIP_DEFLATED) as archive:
+                for number, (stream, _total_lines, _total_amount) in enumerate(files, 1):
+                    stream.seek(0)
+                    # fixed timestamp, so the same files give the same archive
+                    member_info = zipfile.ZipInfo(f'bank_payment_{number:03d}.{file_format.file_extension}')
+                    member_info.compress_type = zipfile.ZIP_DEFLATED
+                    with archive.open(member_info, 'w') as member:
+                        shutil.copyfileobj(stream, member)
+                    stream.close()
+            return self._get_export_attachment('bank_payment.zip', archive_stream, 'application/zip')
+
+    @api.model
+    def _get_export_attachment(self, name: str, stream, mimetype: str):
+        """
+        return export attachment with the same content (found by checksum), or new attachment.
+        Content of stream (file object) is read chunk by chunk, with file storage it is copied
+        into filestore and never loaded whole in memory.
+        """
+        sha = hashlib.sha1()
+        size = 0
+        stream.seek(0)
+        for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+            sha.update(chunk)
+            size += len(chunk)
+        checksum = sha.hexdigest()
+        attachment = self.env['ir.attachment'].sudo().search([
+            ('checksum', '=', checksum),
+            ('name', '=', name),
+            ('mimetype', '=', mimetype),
+            ('res_model', 'in', EXPORT_ATTACHMENT_MODELS),
+        ], limit=1)
+        if attachment:
+            return attachment.with_env(self.env)
+
+        stream.seek(0)
+        if self.env['ir.attachment']._storage() != 'file':
+            return self.env['ir.attachment'].create({'name': name, 'raw': stream.read(), 'mimetype': mimetype})
+        return self.env['ir.attachment'].create({
+            'name': name,
+            'store_fname': self._write_export_file(stream, checksum),
+            'checksum': checksum,
+            'file_size': size,
+            'mimetype': mimetype,
+        })
+
+    @api.model
+    def _write_export_file(self, stream, checksum: str) -> str:
+        """
+        Copy rest of stream into filestore (the same way as ir.attachment stores raw content)
+        return: store_fname of the file
+        """
+        attachment = self.env['ir.attachment']
+        fname = f'{checksum[:2]}/{checksum}'
+        full_path = attachment._full_path(fname)
+        if os.path.isfile(full_path):
+            return fname
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # file is renamed only once complete, a file of the filestore is never partially written
+        temp_path = f'{full_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as file:
+            shutil.copyfileobj(stream, file, STREAM_CHUNK_SIZE)
+        os.replace(temp_path, full_path)
+        # file is removed by filestore gc if transaction is rolled back
+        attachment._mark_for_gc(fname)
+        return fname
+
+    ####################################################
+    # STREAMING
+    ####################################################
+
+    def _can_stream_download(self, move_ids: models.Model, file_format: BankFileFormat) -> bool:
+        """
+        return True if file can be sent while it is generated: streaming is enabled,
+        header of the format does not need totals, all bills are ready for bank payment
+        (so validation can not fail once the file is being sent) and bills of one paying account
+        fit into one file (checked by SQL aggregate)
+        """
+        get_param = self.env['ir.config_parameter'].sudo().get_param
+        if not int(get_param('bank_payment.stream_downloads', 1)) or file_format.header_needs_totals:
+            return False
+        if self.env['account.move'].search_count([
+            ('id', 'in', move_ids.ids),
+            '|', ('bank_payment_ready', '=', False), ('bank_payment_ready_outdated', '=', True),
+        ], limit=1):
+            return False
+        if len(self._get_export_groups(move_ids)) > 1:
+            return False
+
+        max_lines, max_amount = self._get_file_limits()
+        [(count, amount)] = self.env['account.move']._read_group(
+            [('id', 'in', move_ids.ids)], [], ['__count', 'amount_total:sum'])
+        # rows are cut to cents, so their sum is never above sum of amounts
+        return (not max_lines or count <= max_lines) and amount * 100 <= min(max_amount, MAX_FILE_AMOUNT)
+
+    def _archive_streamed_downloads(self) -> bool:
+        """
+        return True if streamed files are stored in batch attachment too (needed to download or verify them later),
+        disabled by default: the file was already sent to the user
+        """
+        return bool(int(self.env['ir.config_parameter'].sudo().get_param('bank_payment.archive_downloads', 0)))
+
+    def _iter_bank_payment_stream(self, move_ids: models.Model, archive: bool, only_new: bool = False):
+        """
+        Yield bank payment file in chunks of bytes as rows are rendered.
+        Batch and log (and archived attachment) are created before the last chunk,
+        they are committed only if the whole file was sent.
+        """
+        move_ids, skipped = move_ids._claim_bank_payment(only_new=only_new)
+        if skipped:
+            self._raise_skipped_bills(skipped)
+
+        file_format = self._get_file_format(move_ids)
+        [(account, _group_ids)] = self._get_export_groups(move_ids)
+        metrics = ExportMetrics(self.env.cr)
+        archive_stream = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) if archive else None
+        stream = StreamBuffer(archive_stream)
+        splitter = self._get_file_splitter(file_format, lambda: stream, account)
+        write_time = 0.0
+        for line, amount in self._iter_bank_payment_rows(move_ids, metrics):
+            start = time.perf_counter()
+            splitter.write(line, amount)
+            write_time += time.perf_counter() - start
+            if stream.size >= STREAM_CHUNK_SIZE:
+                yield stream.take()
+        with metrics.stage('write'):
+            [(_stream, total_lines, total_amount)] = splitter.close()
+        metrics.add('write', write_time, row_count=total_lines)
+
+        name = f'bank_payment.{file_format.file_extension}'
+        attachment = self.env['ir.attachment']
+        if archive_stream:
+            with metrics.stage('attachment'):
+                attachment = self._get_export_attachment(name, archive_stream, file_format.mimetype)
+                archive_stream.close()
+            metrics.add('attachment', row_count=1)
+
+        self.env['bank.payment.batch']._create_batch(
+            move_ids, attachment, total_lines, total_amount, file_format.code)
+        self.env['bank.payment.log']._log_export(name, len(move_ids), metrics, attachment)
+        yield stream.take()
+
+    def _get_validation_report(self, move_ids: models.Model) -> list:
+        """
+        return validation report of all bills (checked chunk by chunk)
+        """
+        report = []
+        for bills in self._iter_prefetched_chunks(move_ids):
+            report += self._validate_bank_payment_data(bills)
+        return report
+
+    def _get_move_ids(self) -> models.Model:
+        """
+        return bills selected for export (in selection order),
+        without bills already exported in a batch if only new bills are requested
+        """
+        move_ids = self.env['account.move'].browse(self.env.context.get('active_ids'))
+        if self.only_new_bills:
+            new_ids = set(self.env['account.move'].search([
+                ('id', 'in', move_ids.ids),
+                ('bank_payment_batch_id', '=', False),
+            ]).ids)
+            move_ids = move_ids.filtered(lambda move: move.id in new_ids)
+            if not move_ids:
+                raise UserError("All selected bills were already exported to bank payment batch.")
+
+        return move_ids
+
+    def action_validate_bank_payment(self):
+        """
+        Check all selected bills and show every problem found in the wizard
         """
         ctx = self.env.context
-        move_ids = self.env['account.move'].browse(ctx.get('active_ids'))
-        datas = base64.b64encode(bytes(self._prepare_bank_payment_data(move_ids), 'utf-8'))
-        attachment_id = self.env['ir.attachment'].create({
-            'name': 'bank_payment.txt',
-            'datas': datas,
-            'mimetype': 'text/plain',
+        report = self._get_validation_report(self._get_move_ids())
+        self.validation_report = self._format_validation_report(report) or 'All bills are ready for bank payment.'
+
+        return {
+            'name': 'Bank Payment',
+            'res_model': 'bank.payment',
+            'res_id': self.id,
+            'view_mode': 'form',
+            'context': ctx,
+            'target': 'new',
+            'type': 'ir.actions.act_window',
+        }
+
+    def action_export_in_background(self):
+        """
+        Create background job for selected bills
+        return: job form, where progress can be followed
+        """
+        move_ids = self._get_move_ids()
+        self._get_file_format(move_ids)  # bills with different formats can not be exported together
+        job = self.env['bank.payment.job'].create({
+            'move_ids': [Command.set(move_ids.ids)],
+            'only_new_bills': self.only_new_bills,
         })
+        if not job.move_ids:
+            raise UserError("Selected bills are being exported by another run.")
+
+        return {
+            'name': 'Bank Payment',
+            'res_model': 'bank.payment.job',
+            'res_id': job.id,
+            'view_mode': 'form',
+            'type': 'ir.actions.act_window',
+        }
+
+    def action_download_bank_payment(self):
+        """
+        return: download bank payment file (streamed while it is generated, if possible)
+        """
+        move_ids = self._get_move_ids()
+        if self._can_stream_download(move_ids, self._get_file_format(move_ids)):
+            self.stream_move_ids = move_ids.ids
+            return {
+                'type': 'ir.actions.act_url',
+                'name': 'Bank Payment',
+                'url': f'/bank_payment/download/{self.id}',
+            }
+
+        move_ids, skipped = move_ids._claim_bank_payment(only_new=self.only_new_bills)
+        if skipped:
+            self._raise_skipped_bills(skipped)
+        file_format = self._get_file_format(move_ids)
+        metrics = ExportMetrics(self.env.cr)
+        files = self._write_bank_payment_files(move_ids, file_format, metrics)
+        with metrics.stage('attachment'):
+            attachment_id = self._create_bank_payment_attachment(files, file_format)
+        metrics.add('attachment', row_count=len(files))
+
+        total_lines = sum(file[1] for file in files)
+        total_amount = sum(file[2] for file in files)
+        self.env['bank.payment.batch']._create_batch(
+            move_ids, attachment_id, total_lines, total_amount, file_format.code)
+        self.env['bank.payment.log']._log_export(attachment_id.name, len(move_ids), metrics, attachment_id)
 
         return {
             'type': 'ir.actions.act_url',